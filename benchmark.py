@@ -0,0 +1,392 @@
+"""
+Benchmarks for the skin selector's hot paths, run against the bundled .themes folder.
+
+Usage:
+    python3 benchmark.py [--json FILE] decode [--repeat N]
+    python3 benchmark.py [--json FILE] keys [--presses N]
+    python3 benchmark.py [--json FILE] install [--repeat N] [--optimise]
+    python3 benchmark.py [--json FILE] startup [--repeat N]
+    python3 benchmark.py [--json FILE] verify [--optimise]
+    python3 benchmark.py [--json FILE] all
+
+keys and the GUI part of startup need a display, they are skipped without one. Nothing is written to the real
+ESP, installs go to a temporary fake REFIND_ROOT.
+"""
+import argparse
+import contextlib
+import io
+import itertools
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import skin_selector_app
+from skin_selector_app import Image, load_reduced, reduction_factor, render_frame
+
+APP_ROOT = os.path.dirname(os.path.abspath(__file__))
+APP_THEMES_ROOT = os.path.join(APP_ROOT, ".themes")
+# window sizes the viewer typically renders at
+SIZES = ((800, 450), (1280, 720), (1920, 1080))
+# the screen size written into the fake refind.conf
+SCREEN_SIZE = (1920, 1080)
+# run in a fresh interpreter to time a cold GUI start up to the first preview on screen
+STARTUP_CHILD = """
+import json, sys, time
+sys.path.insert(0, {app_root!r})
+import skin_selector_app
+root = skin_selector_app.tk.Tk()
+app = skin_selector_app.ThemeSelectorApp(root, refind_root={refind_root!r})
+deadline = time.perf_counter() + 10
+while not app.first_image_shown and time.perf_counter() < deadline:
+    root.update()
+    time.sleep(0.001)
+print(json.dumps(app.startup_timings))
+app.on_close()
+"""
+
+
+def bundled_images(themes_root, min_width=800):
+    """Every bundled image big enough to be shown as a preview (backgrounds, screenshots, samples)."""
+    images = []
+    for dir_path, dir_names, file_names in os.walk(themes_root):
+        # icon sheets and fonts are never previewed
+        dir_names[:] = [d for d in dir_names if not d.startswith('.') and d not in ('icons', 'fonts')]
+        for name in file_names:
+            if not name.lower().endswith(skin_selector_app.PREVIEW_EXTENSIONS):
+                continue
+            path = os.path.join(dir_path, name)
+            try:
+                with Image.open(path) as image:
+                    if image.width >= min_width:
+                        images.append(path)
+            except OSError:
+                continue
+    return sorted(images)
+
+
+def median_time(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+def percentiles(timings):
+    """Summary of a list of seconds, in milliseconds."""
+    timings = sorted(timings)
+    return {'median_ms': statistics.median(timings) * 1000,
+            'p95_ms': timings[min(len(timings) - 1, round(len(timings) * 0.95))] * 1000,
+            'max_ms': timings[-1] * 1000, 'count': len(timings)}
+
+
+@contextlib.contextmanager
+def quiet():
+    """Swallows the app's progress prints so they don't break up the result tables."""
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+
+
+def fake_refind_root(parent):
+    """A minimal rEFInd folder for the app to install into."""
+    refind_root = os.path.join(parent, 'refind')
+    os.makedirs(refind_root)
+    with open(os.path.join(refind_root, 'refind.conf'), 'w') as file:
+        file.write(f'timeout 20\nresolution {SCREEN_SIZE[0]} {SCREEN_SIZE[1]}\n')
+    return refind_root
+
+
+def decode_full(path, width, height):
+    """The original update_image() path: full resolution decode then a LANCZOS resize."""
+    image = Image.open(path)
+    image.load()
+    return render_frame(image, width, height)
+
+
+def decode_reduced(path, width, height):
+    with Image.open(path) as image:
+        size = image.size
+    return render_frame(load_reduced(path, reduction_factor(size, width, height)), width, height)
+
+
+def bench_decode(themes_root=APP_THEMES_ROOT, repeat=3):
+    """Times decode + resize per image and window size, before and after reduced decoding."""
+    results = []
+    for path in bundled_images(themes_root):
+        for width, height in SIZES:
+            before = median_time(lambda: decode_full(path, width, height), repeat)
+            after = median_time(lambda: decode_reduced(path, width, height), repeat)
+            results.append({'image': os.path.relpath(path, themes_root), 'size': f'{width}x{height}',
+                             'before_ms': before * 1000, 'after_ms': after * 1000})
+
+    print(f'{"image":60} {"size":>10} {"before":>10} {"after":>10} {"speedup":>8}')
+    for r in results:
+        print(f'{r["image"]:60} {r["size"]:>10} {r["before_ms"]:>8.1f}ms {r["after_ms"]:>8.1f}ms '
+              f'{r["before_ms"] / r["after_ms"]:>7.2f}x')
+    for width, height in SIZES:
+        size = f'{width}x{height}'
+        before = sum(r['before_ms'] for r in results if r['size'] == size)
+        after = sum(r['after_ms'] for r in results if r['size'] == size)
+        print(f'Total at {size}: {before:.0f}ms before, {after:.0f}ms after ({before / after:.2f}x)')
+    return results
+
+
+def bench_keys(presses=40):
+    """
+    Keypress to paint latency while browsing: each press runs the same handler as the arrow keys, then the Tk
+    loop is run until the new preview is on screen. Cold presses land on previews that were never decoded,
+    warm ones revisit them once prefetching has settled.
+    """
+    try:
+        root = skin_selector_app.tk.Tk()
+    except skin_selector_app.tk.TclError as e:
+        print(f'Skipping keypress latency, no display: {e}')
+        return {'skipped': str(e)}
+
+    with tempfile.TemporaryDirectory() as temp:
+        with quiet():
+            app = skin_selector_app.ThemeSelectorApp(root, refind_root=fake_refind_root(temp))
+            settle(root, lambda: app.first_image_shown)
+            actions = {'theme': (app.next_theme, app.prev_theme), 'bg': (app.next_bg, app.prev_bg)}
+            results = {}
+            for name, (forward, back) in actions.items():
+                for phase in ('cold', 'warm'):
+                    timings = []
+                    for i in range(presses):
+                        if name == 'bg' and not app.bg_images:
+                            # hop to the next theme with backgrounds to step through
+                            while not app.bg_images:
+                                app.next_theme()
+                        if phase == 'cold':
+                            # drop whatever prefetching decoded since the last press
+                            for cache in (app.previews.sources, app.previews.frames, app.previews.photos):
+                                cache.clear()
+                        timings.append(press(root, app, forward if i < presses // 2 else back))
+                    results[f'{name}_{phase}'] = percentiles(timings)
+            app.on_close()
+
+    print(f'{"keypress":12} {"median":>10} {"p95":>10} {"max":>10}')
+    for name, r in results.items():
+        print(f'{name:12} {r["median_ms"]:>8.1f}ms {r["p95_ms"]:>8.1f}ms {r["max_ms"]:>8.1f}ms')
+    return results
+
+
+def settle(root, done, timeout=10):
+    """Runs the Tk loop until done() is true, then until the background work it started has been handed back."""
+    deadline = time.perf_counter() + timeout
+    while not done() and time.perf_counter() < deadline:
+        root.update()
+        time.sleep(0.001)
+    end = time.perf_counter() + 0.3
+    while time.perf_counter() < end:
+        root.update()
+        time.sleep(0.005)
+
+
+def press(root, app, action, timeout=5):
+    """Times one navigation keypress until its preview has been painted, returns seconds."""
+    before = app.current_image
+    start = time.perf_counter()
+    app.handle_keypress(action)
+    deadline = start + timeout
+    while app.current_image is before and time.perf_counter() < deadline:
+        root.update()
+    root.update_idletasks()
+    elapsed = time.perf_counter() - start
+    settle(root, lambda: True, timeout=0)
+    return elapsed
+
+
+def bench_install(themes_root=APP_THEMES_ROOT, repeat=3, optimise=False):
+    """
+    Bytes and wall time of installing every bundled theme into a temporary REFIND_ROOT: a cold install over
+    the previous theme, a reinstall of the same theme once both install buffers hold it, and the banner edit
+    update_config makes (timed on a copy, the bundled configs are never touched). The temporary ESP shares a
+    filesystem with the cache, so hardlinks are turned off to time the copies a real ESP gets.
+    """
+    results = []
+    with tempfile.TemporaryDirectory() as temp:
+        refind_root = fake_refind_root(temp)
+        cache_root = os.path.join(temp, 'cache')
+        hash_cache = skin_selector_app.FileHashCache(os.path.join(cache_root, 'file_hashes.json'))
+        for name in sorted(os.listdir(themes_root)):
+            theme_dir = os.path.join(themes_root, name)
+            config_file = next((os.path.join(theme_dir, c) for c in skin_selector_app.THEME_CONFIG_NAMES
+                                if os.path.isfile(os.path.join(theme_dir, c))), None)
+            if name.startswith('.') or name == 'samples' or config_file is None:
+                continue
+
+            config_copy = os.path.join(temp, f'{name}.conf')
+            shutil.copy2(config_file, config_copy)
+            # alternate between two backgrounds so every timed edit really changes and rewrites the config
+            bg_names = itertools.cycle(('benchmark-a', 'benchmark-b'))
+            config_time = median_time(lambda: skin_selector_app.set_theme_background(
+                config_copy, name, next(bg_names), skin_selector_app.ConfigStore()), repeat)
+
+            with quiet():
+                start = time.perf_counter()
+                cold = skin_selector_app.install_theme(theme_dir, refind_root, cache_root, hash_cache, optimise,
+                                                   link=False)
+                cold_time = time.perf_counter() - start
+                # the staged install alternates between two buffers, the second one still holds the old theme
+                skin_selector_app.install_theme(theme_dir, refind_root, cache_root, hash_cache, optimise, link=False)
+                start = time.perf_counter()
+                again = skin_selector_app.install_theme(theme_dir, refind_root, cache_root, hash_cache, optimise,
+                                                    link=False)
+                again_time = time.perf_counter() - start
+
+            results.append({'theme': name, 'files': cold.files_written + cold.files_skipped,
+                            'cold_bytes': cold.bytes_written, 'cold_ms': cold_time * 1000,
+                            'reinstall_bytes': again.bytes_written, 'reinstall_ms': again_time * 1000,
+                            'config_ms': config_time * 1000, 'copy_methods': dict(cold.methods)})
+
+    print(f'{"theme":16} {"files":>6} {"cold":>10} {"":>10} {"MB/s":>8} {"reinstall":>10} {"":>10} {"config":>8}  '
+          f'copied via')
+    for r in results:
+        rate = r['cold_bytes'] / 1e6 / (r['cold_ms'] / 1000) if r['cold_ms'] else 0
+        methods = ', '.join(f'{method} {count}' for method, count in sorted(r['copy_methods'].items()))
+        print(f'{r["theme"]:16} {r["files"]:>6} {r["cold_bytes"] / 1024:>8.0f}KiB {r["cold_ms"]:>8.1f}ms '
+              f'{rate:>8.1f} {r["reinstall_bytes"] / 1024:>8.0f}KiB {r["reinstall_ms"]:>8.1f}ms '
+              f'{r["config_ms"]:>6.2f}ms  {methods}')
+    return results
+
+
+def tree_mismatches(src_root, dest_root):
+    """Relative paths that differ between two folders: missing, extra, or with different contents."""
+    def files(root):
+        return {os.path.relpath(os.path.join(d, n), root) for d, _, names in os.walk(root) for n in names}
+    src_files, dest_files = files(src_root), files(dest_root)
+    mismatches = sorted(src_files ^ dest_files)
+    for rel in sorted(src_files & dest_files):
+        with open(os.path.join(src_root, rel), 'rb') as a, open(os.path.join(dest_root, rel), 'rb') as b:
+            if a.read() != b.read():
+                mismatches.append(rel)
+    return mismatches
+
+
+def check_installs(themes_root=APP_THEMES_ROOT, optimise=False,
+                   sequence=('pixels', 'simple-grey', 'simple-black', 'pixels', 'simple-grey', 'pixels')):
+    """
+    Not a timing: switches a temporary REFIND_ROOT between themes that share same size, same mtime files
+    (every bundled theme after them, then the sequence again) and compares the installed tree with what
+    should have been installed after each switch. Catches a stale hash skipping a file that changed.
+    """
+    config_names = skin_selector_app.THEME_CONFIG_NAMES
+    names = sorted(n for n in os.listdir(themes_root) if not n.startswith('.') and n != 'samples'
+                   and any(os.path.isfile(os.path.join(themes_root, n, c)) for c in config_names))
+    order = [n for n in sequence if n in names] + names + [n for n in sequence if n in names]
+    results = []
+    with tempfile.TemporaryDirectory() as temp:
+        refind_root = fake_refind_root(temp)
+        cache_root = os.path.join(temp, 'cache')
+        hash_cache = skin_selector_app.FileHashCache(os.path.join(cache_root, 'file_hashes.json'))
+        for name in order:
+            theme_dir = os.path.join(themes_root, name)
+            with quiet():
+                report = skin_selector_app.install_theme(theme_dir, refind_root, cache_root, hash_cache, optimise,
+                                                     link=False)
+            expected = skin_selector_app.optimised_theme_dir(cache_root, name, SCREEN_SIZE, optimise)
+            mismatches = tree_mismatches(expected, os.path.join(refind_root, 'theme'))
+            results.append({'theme': name, 'errors': len(report.errors), 'mismatches': mismatches})
+            status = 'ok' if not mismatches and not report.errors else 'FAILED ' + ', '.join(mismatches)
+            print(f'{name:16} {status}')
+    return results
+
+
+def bench_startup(repeat=3):
+    """
+    Cold start times in fresh interpreters: importing the module, the headless apply command up to its argument
+    check, and (with a display) the GUI up to its window and first preview.
+    """
+    script = os.path.join(APP_ROOT, 'skin_selector.py')
+
+    def run(command):
+        start = time.perf_counter()
+        completed = subprocess.run(command, capture_output=True, text=True)
+        return time.perf_counter() - start, completed
+
+    results = {
+        'python_ms': median_time(lambda: run([sys.executable, '-c', 'pass']), repeat) * 1000,
+        'import_ms': median_time(lambda: run([sys.executable, '-c', 'import skin_selector_app']), repeat) * 1000,
+        'cli_ms': median_time(lambda: run([sys.executable, script, 'apply', '--help']), repeat) * 1000,
+    }
+
+    gui = []
+    with tempfile.TemporaryDirectory() as temp:
+        code = STARTUP_CHILD.format(app_root=APP_ROOT, refind_root=fake_refind_root(temp))
+        for _ in range(repeat):
+            elapsed, completed = run([sys.executable, '-c', code])
+            if completed.returncode != 0:
+                error = completed.stderr.strip().splitlines()[-1] if completed.stderr.strip() else 'failed'
+                print(f'Skipping GUI startup: {error}')
+                results['gui'] = {'skipped': error}
+                break
+            timings = json.loads(completed.stdout.strip().splitlines()[-1])
+            timings['process_ms'] = elapsed * 1000
+            gui.append(timings)
+    if gui:
+        results['gui'] = {name: statistics.median(t[name] for t in gui if name in t) for name in gui[0]}
+
+    for name, value in results.items():
+        if isinstance(value, dict):
+            for gui_name, gui_value in value.items():
+                print(f'gui {gui_name:20} {gui_value if isinstance(gui_value, str) else f"{gui_value:.1f}ms"}')
+        else:
+            print(f'{name:24} {value:.1f}ms')
+    return results
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=APP_ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the skin selector's hot paths.")
+    parser.add_argument("--json", metavar="FILE", help="also write the results to FILE as JSON, - for stdout")
+    subparsers = parser.add_subparsers(dest="suite", required=True)
+    decode = subparsers.add_parser("decode", help="decode + resize time per bundled image, before and after reduced decoding")
+    decode.add_argument("--repeat", type=int, default=3)
+    keys = subparsers.add_parser("keys", help="keypress to paint latency while browsing themes and backgrounds")
+    keys.add_argument("--presses", type=int, default=40)
+    install = subparsers.add_parser("install", help="bytes and time per theme install into a temporary REFIND_ROOT")
+    install.add_argument("--repeat", type=int, default=3)
+    install.add_argument("--optimise", action="store_true", help="run the image optimiser before installing")
+    startup = subparsers.add_parser("startup", help="cold start of the module, the CLI and the GUI")
+    startup.add_argument("--repeat", type=int, default=3)
+    verify = subparsers.add_parser("verify", help="switch installs between themes and check every installed file")
+    verify.add_argument("--optimise", action="store_true", help="run the image optimiser before installing")
+    subparsers.add_parser("all", help="every suite with its default settings")
+    args = parser.parse_args()
+
+    results = {'revision': git_revision(), 'python': platform.python_version(), 'platform': platform.platform(),
+               'cpus': os.cpu_count(), 'time': time.strftime('%Y-%m-%dT%H:%M:%S')}
+    if args.suite in ("decode", "all"):
+        results['decode'] = bench_decode(repeat=getattr(args, 'repeat', 3))
+    if args.suite in ("keys", "all"):
+        results['keys'] = bench_keys(getattr(args, 'presses', 40))
+    if args.suite in ("install", "all"):
+        results['install'] = bench_install(repeat=getattr(args, 'repeat', 3), optimise=getattr(args, 'optimise', False))
+    if args.suite in ("startup", "all"):
+        results['startup'] = bench_startup(getattr(args, 'repeat', 3))
+    if args.suite in ("verify", "all"):
+        results['verify'] = check_installs(optimise=getattr(args, 'optimise', False))
+
+    if args.json == '-':
+        json.dump(results, sys.stdout, indent=2)
+    elif args.json:
+        with open(args.json, 'w') as file:
+            json.dump(results, file, indent=2)
+        print(f'Results written to {args.json}')
+    if any(r['mismatches'] or r['errors'] for r in results.get('verify', [])):
+        sys.exit(1)
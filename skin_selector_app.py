@@ -0,0 +1,3119 @@
+import time  # Import time to manage keypress delays
+STARTUP_TIME = time.perf_counter()  # taken first so startup timings include the imports below
+
+import contextlib
+import errno
+import fcntl
+import fnmatch
+import hashlib
+import importlib
+import json
+import os
+import queue
+import re
+import shutil
+import subprocess
+import sys
+import threading
+from collections import OrderedDict
+
+
+class LazyModule:
+    """Stands in for a module and only imports it the first time one of its attributes is used."""
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+
+# the GUI and imaging modules are by far the slowest imports, so they are only loaded once something needs them
+tk = LazyModule("tkinter")
+messagebox = LazyModule("tkinter.messagebox")
+filedialog = LazyModule("tkinter.filedialog")
+Image = LazyModule("PIL.Image")  # For image handling
+ImageTk = LazyModule("PIL.ImageTk")
+cProfile = LazyModule("cProfile")  # only needed with --profile
+pstats = LazyModule("pstats")
+# only needed by some commands: argument parsing, the copy and preview pools, and theme archives
+argparse = LazyModule("argparse")
+futures = LazyModule("concurrent.futures")
+multiprocessing = LazyModule("multiprocessing")
+tarfile = LazyModule("tarfile")
+zipfile = LazyModule("zipfile")
+
+# where rEFInd lives on a standard install
+DEFAULT_REFIND_ROOT = "/boot/efi/EFI/refind"
+# exit codes of the headless commands
+EXIT_OK = 0
+EXIT_FAILED = 1  # the install itself failed, the previous theme is still in place
+EXIT_USAGE = 2  # bad arguments, same code argparse uses
+EXIT_NO_REFIND = 3  # no rEFInd install at the given root
+HASH_CHUNK_SIZE = 1024 * 1024
+# copy engine: chunk size for in-kernel and fallback copies, and the threads that copy many small files at once
+COPY_CHUNK_SIZE = 8 * 1024 * 1024
+COPY_WORKERS = 4
+FICLONE = 0x40049409  # linux ioctl that makes dest share src's blocks on btrfs, xfs and other reflink filesystems
+# siblings of the installed theme folder used by staged installs
+STAGING_SUFFIX = ".staging"
+ROLLBACK_SUFFIX = ".previous"
+# memory budgets for the preview caches
+SOURCE_CACHE_BYTES = 128 * 1024 * 1024
+FRAME_CACHE_BYTES = 64 * 1024 * 1024
+PHOTO_CACHE_BYTES = 64 * 1024 * 1024
+# most memory one round of prefetching may decode, well under SOURCE_CACHE_BYTES so it never flushes the cache
+PREFETCH_BUDGET_BYTES = 48 * 1024 * 1024
+# how long the window size must stay put before a window drag gets its high quality render
+RESIZE_SETTLE_MS = 150
+# presses of the same arrow closer together than this are one held key, which speeds up after a while
+KEY_REPEAT_GAP = 0.12
+KEY_ACCELERATE_EVERY = 10  # the step doubles after this many repeats
+KEY_MAX_STEP = 8
+# decode at a reduced size only while the remaining resize is still at least this big, which keeps the
+# final LANCZOS pass indistinguishable from a full resolution one (same idea as Pillow's reducing_gap)
+REDUCING_GAP = 2.0
+# widths of the downscaled previews kept for every sample and background image
+PREVIEW_WIDTHS = (800, 1280, 1920)
+PREVIEW_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp')
+# a folder under .themes is only a theme if it has one of these, checked in order
+THEME_CONFIG_NAMES = ("theme.conf", "refind.conf")
+# files and folders themes ship for their authors or READMEs that rEFInd never reads, kept off the ESP
+NON_RUNTIME_DIRS = ('.git', '.github', 'screenshots', 'samples', 'source', 'originals')
+NON_RUNTIME_FILES = ('README*', 'screenshot*', '.editorconfig', '.gitignore', '*.md', '*.txt', '*.svg',
+                     '*.afdesign', '*.xcf')
+# config directives that point at files inside the theme, anything they name is always installed
+PATH_DIRECTIVES = ('banner', 'icons_dir', 'selection_big', 'selection_small', 'font', 'mouse_icon')
+# bump whenever the optimiser output changes so cached optimised themes are rebuilt
+OPTIMISER_VERSION = 2
+# rEFInd's own icon sizes, used when a theme only sets one of them
+DEFAULT_ICON_SIZES = {'small_icon_size': 48, 'big_icon_size': 128}
+# folders themes keep their svg icon sources in, next to or inside icons_dir
+SVG_SOURCE_DIRS = ('originals', 'source', 'svg')
+# thumbnail grid layout and the memory it may hold in PhotoImages
+THUMB_SIZE = (240, 135)
+THUMB_PADDING = 10
+THUMB_LABEL_HEIGHT = 22
+THUMB_CACHE_BYTES = 32 * 1024 * 1024
+# bump whenever ThemeInfo changes shape so old catalogue caches are rebuilt instead of misread
+CATALOGUE_VERSION = 1
+# hidden folder in .themes holding one copy of every unique theme file, hardlinked into the themes using it
+STORE_DIR_NAME = ".store"
+# theme archives the import command and the GUI accept
+ARCHIVE_EXTENSIONS = ('.zip', '.tar.gz', '.tgz', '.tar.bz2', '.tar.xz', '.tar')
+
+
+class Tracer:
+    """
+    Named timing spans around the hot paths (catalogue lookup, decode, resize, PhotoImage, config write,
+    transfer). Disabled, which is the default, span() hands back one shared do-nothing context manager, so
+    tracing costs an attribute check. Enabled, it keeps per span totals for a summary, the spans of the
+    keypress being rendered for the HUD and, while recording, trace events for chrome://tracing or Perfetto.
+    """
+    def __init__(self):
+        self.enabled = False
+        self.verbose = False  # also print the app's progress messages
+        self.recording = False
+        self.totals = {}  # span name -> [count, seconds, slowest]
+        self.last = {}  # span name -> seconds spent on the Tk thread since mark()
+        self.events = []
+        self.lock = threading.Lock()
+        self.main_thread = threading.get_ident()
+
+    def span(self, name):
+        return _Span(self, name) if self.enabled else _NO_SPAN
+
+    def record(self, name, start, seconds):
+        with self.lock:
+            total = self.totals.setdefault(name, [0, 0.0, 0.0])
+            total[0] += 1
+            total[1] += seconds
+            total[2] = max(total[2], seconds)
+            if threading.get_ident() == self.main_thread:
+                self.last[name] = self.last.get(name, 0.0) + seconds
+            if self.recording:
+                self.events.append({'name': name, 'ph': 'X', 'ts': start * 1e6, 'dur': seconds * 1e6,
+                                    'pid': os.getpid(), 'tid': threading.get_ident()})
+
+    def mark(self):
+        """Starts a new breakdown for last, e.g. when a key is pressed."""
+        self.last = {}
+
+    def log(self, message):
+        if self.verbose:
+            print(message)
+
+    def summary(self):
+        lines = [f'{"span":16} {"count":>7} {"total":>10} {"mean":>10} {"max":>10}']
+        for name, (count, seconds, slowest) in sorted(self.totals.items(), key=lambda item: -item[1][1]):
+            lines.append(f'{name:16} {count:>7} {seconds * 1000:>8.1f}ms {seconds / count * 1000:>8.2f}ms '
+                         f'{slowest * 1000:>8.2f}ms')
+        return '\n'.join(lines)
+
+    def write_events(self, path):
+        with self.lock:
+            events = list(self.events)
+        with open(path, 'w') as file:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, file)
+
+
+class _Span:
+    __slots__ = ('tracer', 'name', 'start')
+
+    def __init__(self, tracer, name):
+        self.tracer = tracer
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.tracer.record(self.name, self.start, time.perf_counter() - self.start)
+
+
+_NO_SPAN = contextlib.nullcontext()
+# shared by everything in the module, switched on by --trace, --hud and --profile
+tracer = Tracer()
+
+
+class FileHashCache:
+    """
+    Caches file content hashes keyed by path, size, mtime and inode so unchanged files are only ever read once.
+    The inode catches a folder of files renamed into the place of another (the staged install's buffers), since
+    theme files often share one mtime. Writers of a file should still forget() it, inode numbers get reused.
+    """
+    def __init__(self, cache_file=None, store=None):
+        self.cache_file = cache_file
+        self.hashes = None  # loaded on first use, only installs need it
+        self.dirty = False
+        self.store = store  # optional ContentStore, files linked into it are never read to be hashed
+
+    def load(self):
+        self.hashes = {}
+        if self.cache_file and os.path.exists(self.cache_file):
+            try:
+                with open(self.cache_file, 'r') as file:
+                    self.hashes = json.load(file)
+            except (OSError, ValueError) as e:
+                print(f'Ignoring unreadable hash cache {self.cache_file}: {e}')
+
+    def get(self, path, stat=None):
+        """Returns the sha1 of the file at path, hashing it only if it changed since it was last seen."""
+        if self.hashes is None:
+            self.load()
+        stat = stat if stat else os.stat(path)
+        if self.store and stat.st_nlink > 1:
+            digest = self.store.digest_of(stat)
+            if digest:
+                return digest
+        key = [stat.st_size, stat.st_mtime, stat.st_ino]
+        cached = self.hashes.get(path)
+        if cached and cached[:3] == key:
+            return cached[3]
+
+        digest = hashlib.sha1()
+        with open(path, 'rb') as file:
+            for chunk in iter(lambda: file.read(HASH_CHUNK_SIZE), b''):
+                digest.update(chunk)
+
+        self.hashes[path] = key + [digest.hexdigest()]
+        self.dirty = True
+        return self.hashes[path][3]
+
+    def forget(self, path):
+        """Drops the hash of a file that was just rewritten, so it is read again the next time it's compared."""
+        if self.hashes is None:
+            self.load()
+        if self.hashes.pop(path, None):
+            self.dirty = True
+
+    def save(self):
+        if not self.cache_file or not self.dirty:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.cache_file), exist_ok=True)
+            with open(self.cache_file, 'w') as file:
+                json.dump(self.hashes, file)
+            self.dirty = False
+        except OSError as e:
+            print(f'Unable to save hash cache {self.cache_file}: {e}')
+
+
+class SyncReport:
+    """Counts what a sync wrote, skipped and deleted so the savings of each apply can be checked."""
+    def __init__(self):
+        self.files_written = 0
+        self.bytes_written = 0
+        self.files_skipped = 0
+        self.bytes_skipped = 0
+        self.files_deleted = 0
+        self.errors = []
+        self.cancelled = False
+        self.seconds = 0.0
+        self.methods = {}  # copy technique -> files copied with it
+
+    def __str__(self):
+        text = (f'{self.files_written} files written ({self.bytes_written / 1024:.1f} KiB), '
+                f'{self.files_skipped} unchanged ({self.bytes_skipped / 1024:.1f} KiB skipped), '
+                f'{self.files_deleted} deleted, {len(self.errors)} errors')
+        if self.seconds:
+            text += (f' in {self.seconds * 1000:.0f} ms, {self.bytes_written / 1e6 / self.seconds:.1f} MB/s, '
+                     f'{self.files_written / self.seconds:.0f} files/s')
+        if self.methods:
+            text += ' via ' + ', '.join(f'{method} {count}' for method, count in sorted(self.methods.items()))
+        return text + (' (cancelled)' if self.cancelled else '')
+
+
+class DedupeReport:
+    """What a ContentStore.dedupe pass found and did."""
+    def __init__(self):
+        self.files = 0
+        self.logical_bytes = 0  # what the library would take with every file stored separately
+        self.physical_bytes = 0  # what it actually takes, each shared file counted once
+        self.unique_files = 0
+        self.files_linked = 0
+        self.bytes_freed = 0
+        self.objects = 0
+        self.objects_removed = 0
+        self.errors = []
+
+    def __str__(self):
+        saved = self.logical_bytes - self.physical_bytes
+        return (f'{self.files} files ({self.logical_bytes / 1e6:.1f} MB) stored as {self.unique_files} unique files '
+                f'({self.physical_bytes / 1e6:.1f} MB), {saved / 1e6:.1f} MB saved in total, '
+                f'{self.files_linked} files linked now ({self.bytes_freed / 1e6:.1f} MB freed), '
+                f'{self.objects} objects in the store, {self.objects_removed} unused files removed from the store, {len(self.errors)} errors')
+
+
+class ContentStore:
+    """
+    Content addressed store of theme files: one copy of each unique file kept under its sha1, hardlinked into
+    every theme folder that uses it. Themes still look like plain folders, they just share their disk blocks.
+    The app replaces files rather than writing into them (see RefindConfig.save and copy_file), so editing
+    one theme never changes the others, and theme configs are never shared.
+    """
+    def __init__(self, store_root):
+        self.store_root = store_root
+        self.inodes = None  # (device, inode) -> sha1 of every stored object, built on first use
+        self.pending = {}
+
+    def object_path(self, digest):
+        return os.path.join(self.store_root, digest[:2], digest)
+
+    def load(self):
+        self.inodes = {}
+        if not os.path.isdir(self.store_root):
+            return
+        for fanout in os.scandir(self.store_root):
+            if fanout.is_dir():
+                for entry in os.scandir(fanout.path):
+                    stat = entry.stat()
+                    self.inodes[(stat.st_dev, stat.st_ino)] = entry.name
+
+    def digest_of(self, stat):
+        """sha1 of a file if it is linked to a stored object, from its inode alone, otherwise None."""
+        if self.inodes is None:
+            self.load()
+        return self.inodes.get((stat.st_dev, stat.st_ino))
+
+    def dedupe(self, themes_root, hash_cache, dry_run=False):
+        """
+        Links every file of every theme (and sample) under themes_root to its stored object, adding objects
+        for content seen for the first time, then removes objects no theme uses anymore.
+        :return: a DedupeReport
+        """
+        report = DedupeReport()
+        if self.inodes is None:
+            self.load()
+        self.pending = {}  # digest -> stat of the file a dry run would have stored
+        seen_inodes = set()
+        for dir_path, dir_names, file_names in os.walk(themes_root):
+            # hidden folders are the store itself and the app's caches
+            dir_names[:] = sorted(d for d in dir_names if not d.startswith('.'))
+            for name in sorted(file_names):
+                path = os.path.join(dir_path, name)
+                stat = os.lstat(path)
+                if not os.path.isfile(path) or os.path.islink(path):
+                    continue
+                report.files += 1
+                report.logical_bytes += stat.st_size
+                try:
+                    if name not in THEME_CONFIG_NAMES:
+                        stat = self._link(path, stat, hash_cache, report, dry_run)
+                except OSError as e:
+                    print(f'Unable to dedupe {path}: {e}')
+                    report.errors.append((path, e))
+                if (stat.st_dev, stat.st_ino) not in seen_inodes:
+                    seen_inodes.add((stat.st_dev, stat.st_ino))
+                    report.unique_files += 1
+                    report.physical_bytes += stat.st_size
+
+        # objects left with a single link belong to themes that were deleted or changed
+        for key, digest in list(self.inodes.items()):
+            path = self.object_path(digest)
+            if digest in self.pending:
+                continue
+            try:
+                if os.stat(path).st_nlink == 1:
+                    if not dry_run:
+                        os.remove(path)
+                        del self.inodes[key]
+                    report.objects_removed += 1
+            except OSError as e:
+                report.errors.append((path, e))
+        report.objects = len(self.inodes) - (report.objects_removed if dry_run else 0)
+        if dry_run:
+            self.inodes = None  # forget the objects the dry run only pretended to store
+        return report
+
+    def _link(self, path, stat, hash_cache, report, dry_run):
+        """Points path at the stored copy of its content, storing it first if it is new. Returns the new stat."""
+        if (stat.st_dev, stat.st_ino) in self.inodes:
+            return stat
+        digest = hash_cache.get(path, stat)
+        object_path = self.object_path(digest)
+        if not os.path.exists(object_path) and digest not in self.pending:
+            # the first copy seen becomes the stored object, nothing is copied
+            if dry_run:
+                self.pending[digest] = stat
+            else:
+                os.makedirs(os.path.dirname(object_path), exist_ok=True)
+                os.link(path, object_path)
+            self.inodes[(stat.st_dev, stat.st_ino)] = digest
+            return stat
+
+        object_stat = self.pending.get(digest) or os.stat(object_path)
+        if object_stat.st_size != stat.st_size:
+            return stat
+        # linked files share their permissions and owner too, a file that differs in either keeps its own copy
+        if (object_stat.st_mode, object_stat.st_uid, object_stat.st_gid) != (stat.st_mode, stat.st_uid, stat.st_gid):
+            return stat
+        report.files_linked += 1
+        if stat.st_nlink == 1:
+            report.bytes_freed += stat.st_size
+        if dry_run:
+            return object_stat
+        # link next to the file and rename over it, the file is never missing
+        temp_path = f'{path}.{os.getpid()}.link'
+        os.link(object_path, temp_path)
+        os.replace(temp_path, path)
+        return os.stat(path)
+
+
+def files_match(src_path, src_stat, dest_path, dest_stat, hash_cache):
+    """Returns True if dest already holds the same content as src."""
+    if src_stat.st_size != dest_stat.st_size:
+        return False
+    # mtimes can't be trusted here, files from the same checkout or archive all share one, so compare contents.
+    # both hashes are cached (see FileHashCache), unchanged files are only read the first time they're seen
+    return hash_cache.get(src_path, src_stat) == hash_cache.get(dest_path, dest_stat)
+
+
+# (technique, source device, destination device) pairs a copy technique is unsupported on, never retried
+_copy_unsupported = set()
+# errors that mean a technique can't be used between two filesystems at all
+_COPY_UNSUPPORTED_ERRORS = (errno.EXDEV, errno.ENOSYS, errno.EOPNOTSUPP, errno.ENOTTY)
+# errors that mean a technique can't be used for this one file (too many links, an odd file, a busy
+# executable), the next technique is tried but the technique stays in use for other files
+_COPY_FALLBACK_ERRORS = _COPY_UNSUPPORTED_ERRORS + (errno.EINVAL, errno.EPERM, errno.EMLINK, errno.ETXTBSY)
+
+
+def _technique_failed(error, technique, devices):
+    """Re-raises errors of the copy itself, remembers techniques the two filesystems don't support."""
+    if error.errno not in _COPY_FALLBACK_ERRORS:
+        raise error
+    if error.errno in _COPY_UNSUPPORTED_ERRORS:
+        _copy_unsupported.add((technique, *devices))
+
+
+def _copy_contents(src_fd, dest_fd, size, devices):
+    """Copies size bytes in the kernel when possible, returns the name of the technique that worked."""
+    if ('reflink', *devices) not in _copy_unsupported:
+        try:
+            fcntl.ioctl(dest_fd, FICLONE, src_fd)
+            return 'reflink'
+        except OSError as e:
+            _technique_failed(e, 'reflink', devices)
+
+    for method, copy in (('copy_file_range', getattr(os, 'copy_file_range', None)), ('sendfile', os.sendfile)):
+        if copy is None or (method, *devices) in _copy_unsupported:
+            continue
+        offset = 0
+        try:
+            while offset < size:
+                if method == 'sendfile':
+                    sent = copy(dest_fd, src_fd, offset, min(COPY_CHUNK_SIZE, size - offset))
+                else:
+                    sent = copy(src_fd, dest_fd, min(COPY_CHUNK_SIZE, size - offset), offset, offset)
+                if sent == 0:
+                    break
+                offset += sent
+            if offset == size:
+                return method
+        except OSError as e:
+            _technique_failed(e, method, devices)
+        # start again from scratch with the next technique
+        os.ftruncate(dest_fd, 0)
+        os.lseek(dest_fd, 0, os.SEEK_SET)
+
+    os.lseek(src_fd, 0, os.SEEK_SET)
+    while chunk := os.read(src_fd, COPY_CHUNK_SIZE):
+        os.write(dest_fd, chunk)
+    return 'read/write'
+
+
+def copy_file(src_path, dest_path, src_stat=None, link=True):
+    """
+    Copies src_path to dest_path with its modification time, using the cheapest technique the two
+    filesystems support: a hardlink (only with link=True) or reflink on the same filesystem, otherwise an
+    in-kernel copy_file_range or sendfile, otherwise plain reads and writes. dest_path is always replaced by a
+    new file rather than written in place, so files hardlinked elsewhere are never modified through it.
+    :return: the name of the technique used
+    """
+    src_stat = src_stat or os.stat(src_path)
+    dest_dev = os.stat(os.path.dirname(dest_path) or '.').st_dev
+    devices = (src_stat.st_dev, dest_dev)
+    if os.path.lexists(dest_path):
+        os.remove(dest_path)
+
+    if link and src_stat.st_dev == dest_dev and ('hardlink', *devices) not in _copy_unsupported:
+        try:
+            os.link(src_path, dest_path)
+            return 'hardlink'
+        except OSError as e:
+            _technique_failed(e, 'hardlink', devices)
+
+    src_fd = os.open(src_path, os.O_RDONLY)
+    try:
+        dest_fd = os.open(dest_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, src_stat.st_mode & 0o777)
+        try:
+            method = _copy_contents(src_fd, dest_fd, src_stat.st_size, devices)
+        finally:
+            os.close(dest_fd)
+    finally:
+        os.close(src_fd)
+    # the hash cache is keyed by modification time, so it has to survive the copy (FAT32 can't store the mode bits)
+    os.utime(dest_path, ns=(src_stat.st_atime_ns, src_stat.st_mtime_ns))
+    return method
+
+
+def sync_theme_files(src_root, dest_root, hash_cache, cancel=None, progress=None, link=True):
+    """
+    Makes dest_root an exact copy of src_root, only writing files that changed and only deleting files
+    that no longer belong. Changed files are copied with copy_file on a small thread pool.
+    :param cancel: optional threading.Event, the sync stops between files once it is set
+    :param progress: optional callable, called with the SyncReport after every file copied
+    :param link: passed on to copy_file, False makes every file a real copy even on the same filesystem
+    :return: a SyncReport describing the work done
+    """
+    report = SyncReport()
+    start = time.perf_counter()
+    wanted_dirs = set()
+    wanted_files = set()
+    submitted = {}  # future -> source path of every copy handed to the pool
+    lock = threading.Lock()
+
+    def copy(src_path, dest_path, src_stat):
+        # runs on the copy pool, a handful of threads keep the disk busy with small icon files
+        if cancel and cancel.is_set():
+            return
+        try:
+            method = copy_file(src_path, dest_path, src_stat, link)
+        except OSError as e:
+            print(f"Failed to copy {src_path} to {dest_path}: {e}")
+            with lock:
+                report.errors.append((src_path, e))
+            return
+        with lock:
+            hash_cache.forget(dest_path)
+            report.files_written += 1
+            report.bytes_written += src_stat.st_size
+            report.methods[method] = report.methods.get(method, 0) + 1
+        if progress:
+            progress(report)
+
+    with futures.ThreadPoolExecutor(max_workers=COPY_WORKERS) as pool:
+        for dir_path, dir_names, file_names in os.walk(src_root):
+            if cancel and cancel.is_set():
+                break
+            rel_dir = os.path.relpath(dir_path, src_root)
+            dest_dir = os.path.normpath(os.path.join(dest_root, rel_dir))
+            wanted_dirs.add(dest_dir)
+            if os.path.isfile(dest_dir) or os.path.islink(dest_dir):
+                os.remove(dest_dir)
+            os.makedirs(dest_dir, exist_ok=True)
+
+            for name in file_names:
+                if cancel and cancel.is_set():
+                    break
+
+                src_path = os.path.join(dir_path, name)
+                dest_path = os.path.join(dest_dir, name)
+                wanted_files.add(dest_path)
+                try:
+                    src_stat = os.stat(src_path)
+                    if os.path.isdir(dest_path):
+                        shutil.rmtree(dest_path)
+                    elif os.path.exists(dest_path) and files_match(src_path, src_stat, dest_path, os.stat(dest_path), hash_cache):
+                        with lock:
+                            report.files_skipped += 1
+                            report.bytes_skipped += src_stat.st_size
+                        continue
+                except OSError as e:
+                    print(f"Failed to copy {src_path} to {dest_path}: {e}")
+                    with lock:
+                        report.errors.append((src_path, e))
+                    continue
+                submitted[pool.submit(copy, src_path, dest_path, src_stat)] = src_path
+
+    # copy() records copy failures itself, anything else it raised would otherwise vanish with its future
+    for future, src_path in submitted.items():
+        error = future.exception()
+        if error:
+            print(f"Failed to copy {src_path}: {error}")
+            report.errors.append((src_path, error))
+    report.seconds = time.perf_counter() - start
+    if cancel and cancel.is_set():
+        report.cancelled = True
+        return report
+
+    # remove anything left over from the previous theme, deepest paths first so folders are empty when removed
+    for dir_path, dir_names, file_names in os.walk(dest_root, topdown=False):
+        for name in file_names:
+            path = os.path.join(dir_path, name)
+            if path not in wanted_files:
+                try:
+                    os.remove(path)
+                    report.files_deleted += 1
+                except OSError as e:
+                    print(f"Failed to delete {path}: {e}")
+                    report.errors.append((path, e))
+        if os.path.normpath(dir_path) not in wanted_dirs:
+            try:
+                os.rmdir(dir_path)
+            except OSError as e:
+                print(f"Failed to delete {dir_path}: {e}")
+                report.errors.append((dir_path, e))
+
+    report.seconds = time.perf_counter() - start
+    return report
+
+
+def fsync_tree(root):
+    """Flushes every file and folder under root to disk so a rename of root never exposes unwritten data."""
+    for dir_path, dir_names, file_names in os.walk(root):
+        for name in file_names:
+            fd = os.open(os.path.join(dir_path, name), os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+        fsync_dir(dir_path)
+
+
+def fsync_dir(path):
+    # not every platform/filesystem allows fsync on a folder, the file data is what matters most
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def recover_theme_install(theme_root):
+    """Puts the rollback theme back if an install was interrupted between its two renames."""
+    previous = theme_root + ROLLBACK_SUFFIX
+    if not os.path.exists(theme_root) and os.path.isdir(previous):
+        print(f'Installed theme is missing, restoring rollback from {previous}')
+        os.rename(previous, theme_root)
+        fsync_dir(os.path.dirname(theme_root))
+
+
+def install_theme_staged(src_root, theme_root, hash_cache, cancel=None, progress=None, link=True):
+    """
+    Installs src_root as theme_root without ever exposing a half-copied theme. The theme is synced into a
+    sibling staging folder and flushed to disk, then the live theme is renamed to the rollback folder and the
+    staging folder is renamed into its place. The rollback from two installs ago is recycled as the staging
+    base, so switching back and forth between two themes writes next to nothing.
+    :return: the SyncReport of the staging sync, the live theme is left untouched if it has errors or the
+    install was cancelled
+    """
+    recover_theme_install(theme_root)
+    staging = theme_root + STAGING_SUFFIX
+    previous = theme_root + ROLLBACK_SUFFIX
+
+    # a staging folder left behind by an interrupted install is just as good a base as the old rollback
+    if not os.path.isdir(staging) and os.path.isdir(previous):
+        os.rename(previous, staging)
+    os.makedirs(staging, exist_ok=True)
+
+    report = sync_theme_files(src_root, staging, hash_cache, cancel, progress, link)
+    if report.cancelled:
+        print(f'Staged install of {src_root} cancelled, keeping the current theme.')
+        return report
+    if report.errors:
+        print(f'Staged install of {src_root} failed, keeping the current theme.')
+        return report
+    fsync_tree(staging)
+
+    if os.path.isdir(previous):
+        shutil.rmtree(previous)
+    if os.path.exists(theme_root):
+        os.rename(theme_root, previous)
+    os.rename(staging, theme_root)
+    fsync_dir(os.path.dirname(theme_root))
+    return report
+
+
+class OptimiseReport:
+    """What the install pipeline did to a theme before it was handed to the ESP sync."""
+    def __init__(self):
+        self.files_excluded = 0
+        self.bytes_excluded = 0
+        self.files_reused = 0
+        self.images_resized = 0
+        self.images_recompressed = 0
+        self.bytes_saved = 0
+        self.icons_rendered = 0
+        self.icons_cached = 0
+        self.cancelled = False
+
+    def __str__(self):
+        return (f'{self.files_excluded} non-runtime files excluded ({self.bytes_excluded / 1024:.1f} KiB), '
+                f'{self.images_resized} backgrounds resized, {self.images_recompressed} PNGs recompressed, '
+                f'{self.icons_rendered} icons rendered ({self.icons_cached} cached), '
+                f'{self.bytes_saved / 1024:.1f} KiB saved, {self.files_reused} files reused from cache')
+
+
+def theme_relative_path(value, theme_name):
+    """Maps a path from a theme config (themes/<name>/x, theme/x or x) to a path inside the theme folder."""
+    value = value.strip().strip('"')
+    for prefix in (f'themes/{theme_name}/', 'theme/', f'{theme_name}/'):
+        if value.startswith(prefix):
+            return value[len(prefix):]
+    return value
+
+
+def read_screen_size(refind_config):
+    """Screen size from the resolution directive of refind.conf, None unless it is given as 'width height'."""
+    if not os.path.exists(refind_config):
+        return None
+    values = (RefindConfig.load(refind_config).get('resolution') or '').split()
+    if len(values) == 2 and all(v.isdigit() for v in values):
+        return int(values[0]), int(values[1])
+    return None
+
+
+def is_runtime_file(rel_path, referenced):
+    """False for files rEFInd never reads, unless the theme config references them."""
+    if rel_path in referenced or any(rel_path.startswith(d + '/') for d in referenced):
+        return True
+    parts = rel_path.split('/')
+    if any(part in NON_RUNTIME_DIRS for part in parts[:-1]):
+        return False
+    return not any(fnmatch.fnmatch(parts[-1], pattern) for pattern in NON_RUNTIME_FILES)
+
+
+def optimise_image(src_path, dest_path, screen_size, is_background):
+    """
+    Writes an optimised copy of a PNG: backgrounds bigger than the screen are scaled down to cover it, and
+    every PNG is re-saved with maximum lossless compression. Falls back to the original bytes whenever the
+    result isn't smaller. Returns (resized, recompressed).
+    """
+    resized = False
+    with Image.open(src_path) as image:
+        image.load()
+        if is_background and screen_size:
+            # banner_scale fillscreen covers the screen, so the image must still cover it after scaling
+            scale = max(screen_size[0] / image.width, screen_size[1] / image.height)
+            if scale < 1:
+                image = image.resize((round(image.width * scale), round(image.height * scale)),
+                                     Image.Resampling.LANCZOS)
+                resized = True
+        image.save(dest_path + '.tmp', 'PNG', optimize=True)
+
+    if not resized and os.path.getsize(dest_path + '.tmp') >= os.path.getsize(src_path):
+        os.remove(dest_path + '.tmp')
+        copy_file(src_path, dest_path)
+        return False, False
+    os.replace(dest_path + '.tmp', dest_path)
+    return resized, True
+
+
+_svg_renderer = None
+
+
+def svg_renderer():
+    """
+    Returns a function(svg_path, png_path, size) that renders an svg locally, using cairosvg when it is
+    installed and the rsvg-convert tool otherwise. None when neither is available.
+    """
+    global _svg_renderer
+    if _svg_renderer is None:
+        try:
+            import cairosvg
+
+            def render(svg_path, png_path, size):
+                cairosvg.svg2png(url=svg_path, write_to=png_path, output_width=size)
+        except ImportError:
+            rsvg_convert = shutil.which('rsvg-convert')
+
+            def render(svg_path, png_path, size):
+                subprocess.run([rsvg_convert, '-w', str(size), '-o', png_path, svg_path],
+                               check=True, capture_output=True)
+            if not rsvg_convert:
+                render = False
+        _svg_renderer = render
+    return _svg_renderer or None
+
+
+def icon_size_for(name, sizes):
+    """The size rEFInd draws an icon at, from its file name, or None for icons it doesn't size."""
+    if name.startswith(('os_', 'boot_')):
+        return sizes['big_icon_size']
+    if name.startswith(('func_', 'tool_', 'arrow_')):
+        return sizes['small_icon_size']
+    if name.startswith('vol_'):
+        # volume badges are drawn at a quarter of the big icon size
+        return sizes['big_icon_size'] // 4
+    return None
+
+
+def find_icon_sources(theme_dir, icons_rel):
+    """Maps icon names to the svg they can be rendered from, svgs in icons_dir itself win over source folders."""
+    icons_dir = os.path.join(theme_dir, icons_rel)
+    candidates = [os.path.join(os.path.dirname(icons_dir), d) for d in SVG_SOURCE_DIRS]
+    candidates += [os.path.join(icons_dir, d) for d in SVG_SOURCE_DIRS] + [icons_dir]
+    sources = {}
+    for folder in candidates:
+        if os.path.isdir(folder):
+            for entry in os.scandir(folder):
+                if entry.is_file() and entry.name.lower().endswith('.svg'):
+                    sources[entry.name[:-4]] = entry.path
+    return sources
+
+
+def render_icon(svg_path, size, cache_dir, render):
+    """Renders svg_path at size into the icon cache keyed by (svg hash, size). Returns (png_path, was_cached)."""
+    with open(svg_path, 'rb') as file:
+        digest = hashlib.sha1(file.read()).hexdigest()
+    png_path = os.path.join(cache_dir, f'{digest}_{size}.png')
+    if os.path.exists(png_path):
+        return png_path, True
+    render(svg_path, png_path + '.tmp', size)
+    os.replace(png_path + '.tmp', png_path)
+    return png_path, False
+
+
+def rasterise_theme_icons(theme_dir, output_dir, config, cache_dir, report, workers=None):
+    """
+    Renders a theme's svg icons into the icons_dir of output_dir at exactly the small_icon_size and
+    big_icon_size its config asks for. Only done when the config sets a size, an svg exists for the icon and
+    a renderer is available, otherwise the theme's own pngs are used. Renders run in a thread pool and are
+    cached across themes and installs.
+    :return: the output relative paths that were written from rendered icons
+    """
+    if not any(config.get(d) for d in DEFAULT_ICON_SIZES) or not config.get('icons_dir'):
+        return set()
+    render = svg_renderer()
+    theme_name = os.path.basename(os.path.normpath(theme_dir))
+    icons_rel = theme_relative_path(config.get('icons_dir'), theme_name).strip('/')
+    sources = find_icon_sources(theme_dir, icons_rel)
+    if not sources:
+        return set()
+    if not render:
+        print(f'No svg renderer found (install cairosvg or rsvg-convert), using the icons {theme_name} ships')
+        return set()
+
+    sizes = {d: int(config.get(d)) if (config.get(d) or '').isdigit() else default
+             for d, default in DEFAULT_ICON_SIZES.items()}
+    jobs = {f'{icons_rel}/{name}.png': (svg_path, icon_size_for(name, sizes)) for name, svg_path in sources.items()}
+    jobs = {rel: job for rel, job in jobs.items() if job[1]}
+    os.makedirs(cache_dir, exist_ok=True)
+
+    written = set()
+    with futures.ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+        submitted = {rel: pool.submit(render_icon, svg_path, size, cache_dir, render)
+                   for rel, (svg_path, size) in jobs.items()}
+        for rel, future in submitted.items():
+            try:
+                png_path, cached = future.result()
+            except (OSError, subprocess.CalledProcessError) as e:
+                print(f'Unable to render {jobs[rel][0]}, using the shipped icon: {e}')
+                continue
+            dest_path = os.path.join(output_dir, rel)
+            os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+            if not os.path.exists(dest_path) or os.stat(dest_path).st_mtime != os.stat(png_path).st_mtime:
+                copy_file(png_path, dest_path)
+            report.icons_rendered += 1
+            report.icons_cached += cached
+            written.add(rel)
+    return written
+
+
+def optimise_theme(theme_dir, output_dir, screen_size=None, optimise_images=True, cancel=None, icon_cache_dir=None):
+    """
+    Builds the tree that actually gets installed for theme_dir in output_dir: non-runtime files are left out,
+    backgrounds are scaled to the screen and PNGs recompressed. The output is cached, a manifest of the
+    source size and mtime of every file means a repeat install only processes files that changed.
+    :return: an OptimiseReport, with cancelled set if cancel was set part way through
+    """
+    report = OptimiseReport()
+    theme_name = os.path.basename(os.path.normpath(theme_dir))
+    # kept next to the output rather than in it so it never ends up on the ESP
+    manifest_file = os.path.normpath(output_dir) + '.json'
+    settings = [OPTIMISER_VERSION, list(screen_size) if screen_size else None, optimise_images]
+    manifest = {'settings': settings, 'files': {}}
+    if os.path.exists(manifest_file):
+        try:
+            with open(manifest_file, 'r') as file:
+                cached = json.load(file)
+            if cached.get('settings') == settings:
+                manifest['files'] = cached['files']
+        except (OSError, ValueError) as e:
+            print(f'Ignoring unreadable optimiser manifest {manifest_file}: {e}')
+    cached_files = manifest['files']
+    manifest['files'] = {}
+
+    config_path = next((os.path.join(theme_dir, c) for c in THEME_CONFIG_NAMES
+                        if os.path.isfile(os.path.join(theme_dir, c))), None)
+    config = RefindConfig.load(config_path) if config_path else RefindConfig(None)
+    referenced = {theme_relative_path(line.value, theme_name) for d in PATH_DIRECTIVES for line in config.directives(d)}
+    backgrounds = {theme_relative_path(line.value, theme_name) for line in config.directives('banner')}
+    rendered = set()
+    if icon_cache_dir:
+        rendered = rasterise_theme_icons(theme_dir, output_dir, config, icon_cache_dir, report)
+        manifest['files'].update({rel: ['rendered'] for rel in rendered})
+
+    for dir_path, dir_names, file_names in os.walk(theme_dir):
+        dir_names.sort()
+        for name in sorted(file_names):
+            if cancel and cancel.is_set():
+                report.cancelled = True
+                return report
+            src_path = os.path.join(dir_path, name)
+            rel_path = os.path.relpath(src_path, theme_dir).replace(os.sep, '/')
+            stat = os.stat(src_path)
+            if not is_runtime_file(rel_path, referenced):
+                report.files_excluded += 1
+                report.bytes_excluded += stat.st_size
+                continue
+            if rel_path in rendered:
+                continue
+
+            dest_path = os.path.join(output_dir, rel_path)
+            signature = [stat.st_size, stat.st_mtime]
+            if cached_files.get(rel_path, [None])[0] == signature and os.path.exists(dest_path):
+                manifest['files'][rel_path] = cached_files[rel_path]
+                report.files_reused += 1
+                continue
+
+            os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+            is_background = rel_path in backgrounds or rel_path.startswith('bg/')
+            resized = recompressed = False
+            if optimise_images and name.lower().endswith('.png'):
+                try:
+                    resized, recompressed = optimise_image(src_path, dest_path, screen_size, is_background)
+                except OSError as e:
+                    print(f'Unable to optimise {src_path}, installing it as is: {e}')
+                    copy_file(src_path, dest_path)
+            else:
+                copy_file(src_path, dest_path)
+            report.images_resized += resized
+            report.images_recompressed += recompressed
+            report.bytes_saved += stat.st_size - os.path.getsize(dest_path)
+            manifest['files'][rel_path] = [signature]
+
+    # drop output for files that were removed from the theme or are now excluded
+    for dir_path, dir_names, file_names in os.walk(output_dir, topdown=False):
+        for name in file_names:
+            path = os.path.join(dir_path, name)
+            rel_path = os.path.relpath(path, output_dir).replace(os.sep, '/')
+            if rel_path not in manifest['files']:
+                os.remove(path)
+        if dir_path != output_dir and not os.listdir(dir_path):
+            os.rmdir(dir_path)
+
+    os.makedirs(output_dir, exist_ok=True)
+    with open(manifest_file + '.tmp', 'w') as file:
+        json.dump(manifest, file)
+    os.replace(manifest_file + '.tmp', manifest_file)
+    return report
+
+
+def optimised_theme_dir(cache_root, theme_name, screen_size, optimise_images):
+    """
+    Where optimise_theme keeps the installable tree of a theme. Every combination of settings gets its own
+    folder, so GUI installs (images optimised) and headless ones (copied as is) don't wipe each other's cache.
+    """
+    size = f'{screen_size[0]}x{screen_size[1]}' if screen_size else 'any'
+    return os.path.join(cache_root, "optimised", theme_name,
+                        f'v{OPTIMISER_VERSION}-{size}-{"png" if optimise_images else "plain"}')
+
+
+def optimised_background(bg_source, theme_dir, refind_root, cache_root, optimise_images=True):
+    """
+    Returns the file the ESP should get for a background, so switching backgrounds writes the same bytes a
+    full install would: the copy optimise_theme made if the background is part of the theme, otherwise (sample
+    backgrounds) a copy scaled and recompressed the same way, cached per screen size.
+    """
+    theme_name = os.path.basename(os.path.normpath(theme_dir))
+    screen_size = read_screen_size(os.path.join(refind_root, "refind.conf"))
+    if bg_source.startswith(os.path.join(theme_dir, '')):
+        optimised = os.path.join(optimised_theme_dir(cache_root, theme_name, screen_size, optimise_images),
+                                 os.path.relpath(bg_source, theme_dir))
+        if os.path.isfile(optimised):
+            return optimised
+    if not optimise_images or not bg_source.lower().endswith('.png'):
+        return bg_source
+
+    size_dir = f'{screen_size[0]}x{screen_size[1]}' if screen_size else 'any'
+    dest = os.path.join(cache_root, "backgrounds", size_dir, theme_name, os.path.basename(bg_source))
+    if os.path.exists(dest) and os.path.getmtime(dest) >= os.path.getmtime(bg_source):
+        return dest
+    try:
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        optimise_image(bg_source, dest, screen_size, True)
+    except OSError as e:
+        print(f'Unable to optimise {bg_source}, installing it as is: {e}')
+        return bg_source
+    return dest
+
+
+def install_background(theme_root, config_name, bg_source, bg_rel_path, banner, hash_cache, configs, link=True):
+    """
+    Fast path for changing only the background of the installed theme: copies the one background image
+    (if it isn't there already) and points the installed config's banner directive at it, instead of
+    re-installing the whole theme.
+    :return: a SyncReport of the (at most two) files written
+    """
+    report = SyncReport()
+    dest = os.path.join(theme_root, bg_rel_path)
+    src_stat = os.stat(bg_source)
+    if os.path.exists(dest) and files_match(bg_source, src_stat, dest, os.stat(dest), hash_cache):
+        report.files_skipped += 1
+        report.bytes_skipped += src_stat.st_size
+    else:
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        copy_file(bg_source, dest + '.tmp', link=link)
+        os.replace(dest + '.tmp', dest)
+        hash_cache.forget(dest)
+        report.files_written += 1
+        report.bytes_written += src_stat.st_size
+
+    config = configs.get(os.path.join(theme_root, config_name))
+    config.set('banner', banner)
+    if config.save():
+        report.files_written += 1
+        report.bytes_written += os.path.getsize(config.path)
+    return report
+
+
+def install_theme(theme_dir, refind_root, cache_root, hash_cache, optimise_images=True, cancel=None, progress=None,
+                  bg_source=None, configs=None, link=True):
+    """
+    Installs theme_dir as the theme folder of the rEFInd install at refind_root. The theme goes through
+    optimise_theme first so only runtime files, sized for the screen, are written to the ESP, then replaces
+    the installed theme with install_theme_staged. Shared by the GUI and the headless apply command.
+    :param bg_source: optional background image the theme's config points at, backgrounds that only exist as
+    samples outside theme_dir are copied into the installed theme's bg folder
+    :param configs: optional ConfigStore to edit the installed config through
+    :param link: False copies every file even where a hardlink would do, so benchmarks measure real writes
+    :return: the SyncReport of the install
+    """
+    theme_root = os.path.join(refind_root, "theme")
+    screen_size = read_screen_size(os.path.join(refind_root, "refind.conf"))
+    optimised_dir = optimised_theme_dir(cache_root, os.path.basename(os.path.normpath(theme_dir)), screen_size,
+                                        optimise_images)
+    with tracer.span('optimise'):
+        optimised = optimise_theme(theme_dir, optimised_dir, screen_size, optimise_images, cancel,
+                                   os.path.join(cache_root, "icons"))
+    if optimised.cancelled:
+        report = SyncReport()
+        report.cancelled = True
+        return report
+    print(f"Optimised '{theme_dir}' for {screen_size or 'an unknown screen size'}: {optimised}")
+    with tracer.span('transfer'):
+        report = install_theme_staged(optimised_dir, theme_root, hash_cache, cancel, progress, link)
+    print(f"Installed '{theme_dir}' to '{theme_root}': {report}")
+    in_theme = bg_source and bg_source.startswith(os.path.join(theme_dir, ''))
+    if bg_source and not in_theme and not report.errors and not report.cancelled:
+        # backgrounds that only exist as samples are copied in next to the theme's own files
+        theme_name = os.path.basename(os.path.normpath(theme_dir))
+        config_name = next((c for c in THEME_CONFIG_NAMES if os.path.isfile(os.path.join(theme_root, c))), None)
+        bg_file = os.path.basename(bg_source)
+        if config_name:
+            source = optimised_background(bg_source, theme_dir, refind_root, cache_root, optimise_images)
+            with tracer.span('transfer'):
+                bg_report = install_background(theme_root, config_name, source, os.path.join('bg', bg_file),
+                                               f'themes/{theme_name}/bg/{bg_file}', hash_cache,
+                                               configs or ConfigStore(), link)
+            report.files_written += bg_report.files_written
+            report.bytes_written += bg_report.bytes_written
+            report.files_skipped += bg_report.files_skipped
+            report.bytes_skipped += bg_report.bytes_skipped
+    return report
+
+
+def set_theme_background(theme_config_file, theme_name, bg_name, configs, bg_folder_name='bg'):
+    """Points the banner of a theme's config at one of its backgrounds."""
+    config = configs.get(theme_config_file)
+    config.set('banner', f'themes/{theme_name}/{bg_folder_name}/{bg_name}.png')
+    config.save()
+
+
+class Job:
+    """A unit of work for the BackgroundWorker, the function it runs receives the job itself."""
+    def __init__(self, key, fn, on_done=None, on_error=None, on_progress=None):
+        self.key = key
+        self.fn = fn
+        self.on_done = on_done
+        self.on_error = on_error
+        self.on_progress = on_progress
+        self.cancel_event = threading.Event()
+        self.post = None  # set by the worker, hands a callback over to the Tk thread
+
+    def cancelled(self):
+        return self.cancel_event.is_set()
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def progress(self, *args):
+        if self.on_progress and not self.cancelled():
+            self.post(self.on_progress, *args)
+
+
+class BackgroundWorker:
+    """
+    Runs slow disk work off the Tk thread. Jobs that share a key never run at the same time and are
+    coalesced: submitting a job cancels the queued or running job with the same key, so only the latest
+    request for e.g. the ESP is ever carried out. A job whose key is still running is parked rather than
+    holding a thread while it waits, and queued again once the running job finishes. Callbacks are handed
+    back to the Tk thread by polling a queue with root.after, since Tk must only be touched from the thread
+    running the mainloop.
+    """
+    def __init__(self, root, workers=2, poll_ms=50):
+        self.root = root
+        self.poll_ms = poll_ms
+        self.jobs = queue.Queue()
+        self.callbacks = queue.Queue()
+        self.latest = {}  # key -> most recently submitted job
+        self.running = set()  # keys with a job running right now
+        self.parked = {}  # key -> job waiting for the running job with its key to finish
+        self.lock = threading.Lock()
+        self.threads = [threading.Thread(target=self._run, daemon=True) for _ in range(workers)]
+        for thread in self.threads:
+            thread.start()
+        self.root.after(self.poll_ms, self._poll)
+
+    def submit(self, key, fn, on_done=None, on_error=None, on_progress=None):
+        job = Job(key, fn, on_done, on_error, on_progress)
+        job.post = lambda callback, *args: self.callbacks.put((callback, args))
+        with self.lock:
+            superseded = self.latest.get(key)
+            if superseded:
+                superseded.cancel()
+            self.latest[key] = job
+        self.jobs.put(job)
+        return job
+
+    def cancel(self, key):
+        with self.lock:
+            job = self.latest.get(key)
+        if job:
+            job.cancel()
+
+    def busy(self, key):
+        with self.lock:
+            job = self.latest.get(key)
+        return job is not None and not job.cancelled()
+
+    def shutdown(self, timeout=5):
+        """Cancels everything and gives running jobs a moment to stop at a safe point."""
+        with self.lock:
+            for job in self.latest.values():
+                job.cancel()
+        for _ in self.threads:
+            self.jobs.put(None)
+        for thread in self.threads:
+            thread.join(timeout)
+
+    def _run(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                return
+            if job.cancelled():
+                continue
+            with self.lock:
+                if job.key in self.running:
+                    # an older parked job has been superseded by this one, so it is simply replaced
+                    self.parked[job.key] = job
+                    continue
+                self.running.add(job.key)
+            callback = None
+            try:
+                result = job.fn(job)
+                if job.on_done and not job.cancelled():
+                    callback, args = job.on_done, (result,)
+            except Exception as e:
+                print(f'Background job "{job.key}" failed: {e}')
+                if job.on_error:
+                    callback, args = job.on_error, (e,)
+            finally:
+                with self.lock:
+                    self.running.discard(job.key)
+                    if self.latest.get(job.key) is job:
+                        del self.latest[job.key]
+                    parked = self.parked.pop(job.key, None)
+                if parked:
+                    self.jobs.put(parked)
+            # posted once the job is no longer the latest, so busy() is already False in its callbacks
+            if callback:
+                job.post(callback, *args)
+
+    def _poll(self):
+        while True:
+            try:
+                callback, args = self.callbacks.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                callback(*args)
+            except Exception as e:
+                print(f'Background job callback failed: {e}')
+        self.root.after(self.poll_ms, self._poll)
+
+
+class LRUCache:
+    """
+    Least recently used cache capped by the total estimated size of its values, with hit/miss counters.
+    Thread safe so images can be filled in from worker threads.
+    """
+    def __init__(self, name, max_bytes):
+        self.name = name
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # key -> (value, size)
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def __contains__(self, key):
+        with self.lock:
+            return key in self.entries
+
+    def put(self, key, value, size):
+        with self.lock:
+            if key in self.entries:
+                self.total_bytes -= self.entries.pop(key)[1]
+            # anything bigger than the whole budget would just flush the cache for nothing
+            if size > self.max_bytes:
+                return
+            self.entries[key] = (value, size)
+            self.total_bytes += size
+            while self.total_bytes > self.max_bytes:
+                evicted_key, (evicted, evicted_size) = self.entries.popitem(last=False)
+                self.total_bytes -= evicted_size
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.total_bytes = 0
+
+    def __str__(self):
+        return (f'{self.name}: {len(self.entries)} entries, {self.total_bytes / 1024 / 1024:.1f}/'
+                f'{self.max_bytes / 1024 / 1024:.0f} MiB, {self.hits} hits, {self.misses} misses')
+
+
+def image_size_bytes(image):
+    """Rough in-memory size of a decoded PIL image."""
+    return image.width * image.height * len(image.getbands())
+
+
+def reduction_factor(source_size, width, height):
+    """Largest power of two a source can be shrunk by before fitting into width x height, keeping REDUCING_GAP."""
+    ratio = max(source_size[0] / max(width, 1), source_size[1] / max(height, 1))
+    factor = 1
+    while factor * 2 * REDUCING_GAP <= ratio:
+        factor *= 2
+    return factor
+
+
+def load_reduced(path, factor):
+    """
+    Decodes path at 1/factor of its size. JPEGs are decoded straight at the lower resolution with draft(),
+    other formats are decoded in full and box reduced, which still makes the following resize much cheaper.
+    """
+    image = Image.open(path)
+    full_width = image.width
+    if factor > 1 and image.format == 'JPEG':
+        image.draft('RGB', (image.width // factor, image.height // factor))
+    image.load()  # decode now and release the file handle
+
+    # reduce() and smooth resizing only work on plain colour and grey images, so palette, 1 bit and 16 bit
+    # images (common in theme PNGs) are converted first, keeping any transparency
+    if image.mode not in ('RGB', 'RGBA', 'L', 'LA'):
+        if image.mode.startswith('I;16') or image.mode in ('I', 'F'):
+            image = image.point(lambda value: value * (1 / 256)).convert('L')
+        elif image.mode in ('1', 'L') or (image.mode == 'P' and image.palette.mode == 'L'):
+            image = image.convert('LA' if 'transparency' in image.info else 'L')
+        else:
+            has_alpha = 'transparency' in image.info or image.mode.endswith(('A', 'a'))
+            image = image.convert('RGBA' if has_alpha else 'RGB')
+
+    # draft() only scales by what the JPEG decoder supports, box reduce whatever is left
+    remaining = factor * image.width // full_width
+    if remaining > 1:
+        image = image.reduce(remaining)
+    return image
+
+
+def render_frame(image, width, height, resample=None):
+    """Scales image to fit inside width x height, centred on a black canvas of exactly that size."""
+    width, height = max(width, 1), max(height, 1)
+    img_ratio = image.width / image.height
+    window_ratio = width / height
+
+    if img_ratio > window_ratio:
+        new_width = width
+        new_height = max(int(new_width / img_ratio), 1)
+    else:
+        new_height = height
+        new_width = max(int(new_height * img_ratio), 1)
+
+    resample = Image.Resampling.LANCZOS if resample is None else resample
+    resized_image = image.resize((new_width, new_height), resample)
+    final_image = Image.new("RGB", (width, height), (0, 0, 0))
+    paste_x = (width - new_width) // 2
+    paste_y = (height - new_height) // 2
+    final_image.paste(resized_image, (paste_x, paste_y))
+    return final_image
+
+
+class PreviewCache:
+    """
+    Caches decoded source images by path and rendered frames by (path, size), so revisiting a preview
+    skips the decode, the resize and the PhotoImage conversion. Keys include the file mtime so edited
+    images are picked up.
+    """
+    def __init__(self, mtime_of=os.path.getmtime, size_of=None):
+        self.mtime_of = mtime_of
+        self.size_of = size_of  # optional lookup of already known image sizes, returns None if unknown
+        self.sizes = {}  # source key -> full (width, height), so picking a reduction never reopens the file
+        self.sources = LRUCache('sources', SOURCE_CACHE_BYTES)
+        self.frames = LRUCache('frames', FRAME_CACHE_BYTES)
+        self.photos = LRUCache('photos', PHOTO_CACHE_BYTES)  # Tk objects, only touch from the Tk thread
+
+    def source_key(self, path):
+        return path, self.mtime_of(path)
+
+    def source(self, path, width=None, height=None):
+        """Returns path decoded at the smallest reduction that still renders well at width x height."""
+        source_key = self.source_key(path)
+        size = self.sizes.get(source_key) or (self.size_of(path) if self.size_of else None)
+        if size is None:
+            with Image.open(path) as image:
+                size = self.sizes[source_key] = image.size
+        factor = reduction_factor(size, width, height) if width and height else 1
+
+        key = (source_key, factor)
+        image = self.sources.get(key)
+        if image is None:
+            with tracer.span('decode'):
+                image = load_reduced(path, factor)
+            self.sources.put(key, image, image_size_bytes(image))
+        return image
+
+    def frame(self, path, width, height):
+        key = (self.source_key(path), width, height)
+        frame = self.frames.get(key)
+        if frame is None:
+            source = self.source(path, width, height)
+            with tracer.span('resize'):
+                frame = render_frame(source, width, height)
+            self.frames.put(key, frame, image_size_bytes(frame))
+        return frame
+
+    def photo(self, path, width, height):
+        key = (self.source_key(path), width, height)
+        photo = self.photos.get(key)
+        if photo is None:
+            frame = self.frame(path, width, height)
+            with tracer.span('photo'):
+                photo = ImageTk.PhotoImage(frame)
+            self.photos.put(key, photo, image_size_bytes(frame))
+        return photo
+
+    def fast_photo(self, path, width, height):
+        """
+        Cheap stand-in used while the window is being dragged: the high quality photo if it is already cached,
+        otherwise a NEAREST scaled frame that is neither cached nor worth caching.
+        """
+        photo = self.photos.get((self.source_key(path), width, height))
+        if photo is None:
+            source = self.source(path, width, height)
+            with tracer.span('resize'):
+                frame = render_frame(source, width, height, Image.Resampling.NEAREST)
+            with tracer.span('photo'):
+                photo = ImageTk.PhotoImage(frame)
+        return photo
+
+    def __str__(self):
+        return f'{self.sources}\n{self.frames}\n{self.photos}'
+
+
+def generate_previews(source, targets):
+    """
+    Writes downscaled copies of source, targets maps each preview width to its output path.
+    :return: the (width, height) of the source image
+    """
+    with Image.open(source) as image:
+        source_size = image.size
+        image.load()
+        # previews are always shown on black, so flatten any transparency onto black once here
+        if image.mode in ('RGBA', 'LA', 'P'):
+            image = image.convert('RGBA')
+            flat = Image.new('RGB', image.size, (0, 0, 0))
+            flat.paste(image, mask=image.getchannel('A'))
+            image = flat
+        elif image.mode != 'RGB':
+            image = image.convert('RGB')
+
+        for width, output in sorted(targets.items(), reverse=True):
+            height = max(round(source_size[1] * width / source_size[0]), 1)
+            # each smaller preview is scaled from the previous one, which is much cheaper than the source
+            image = image.resize((width, height), Image.Resampling.LANCZOS)
+            os.makedirs(os.path.dirname(output), exist_ok=True)
+            image.save(output + '.tmp', 'JPEG', quality=90)
+            os.replace(output + '.tmp', output)
+    return source_size
+
+
+def build_previews(source, targets):
+    """
+    Generates the previews of one source, skipping widths the source doesn't exceed. Module level so it can
+    run in a worker process. Returns (source_size, targets written, seconds taken).
+    """
+    start = time.perf_counter()
+    with Image.open(source) as image:
+        source_width = image.width
+    # no point storing a preview as big or bigger than the source itself
+    targets = {w: p for w, p in targets.items() if w < source_width}
+    return generate_previews(source, targets), targets, time.perf_counter() - start
+
+
+class PreviewStore:
+    """
+    Downscaled previews of every sample and background image, at each of PREVIEW_WIDTHS narrower than the
+    source. A manifest records the source mtime and size so only stale previews are regenerated, and the
+    viewer can pick the smallest preview that still covers the window without opening the source.
+    """
+    def __init__(self, themes_root, sample_root, store_root, bg_folder_name='bg', mtime_of=os.path.getmtime):
+        self.themes_root = themes_root
+        self.mtime_of = mtime_of
+        self.sample_root = sample_root
+        self.store_root = store_root
+        self.bg_folder_name = bg_folder_name
+        self.manifest_file = os.path.join(store_root, 'manifest.json')
+        self.manifest = {}  # source path relative to themes_root -> {mtime, size, previews: {width: path}}
+        self.lock = threading.Lock()
+        if os.path.exists(self.manifest_file):
+            try:
+                with open(self.manifest_file, 'r') as file:
+                    self.manifest = json.load(file)
+            except (OSError, ValueError) as e:
+                print(f'Ignoring unreadable preview manifest {self.manifest_file}: {e}')
+
+    def find_sources(self):
+        """Every image the viewer can show: everything under samples/ plus each theme's bg/ folder."""
+        sources = []
+        folders = [self.sample_root]
+        if os.path.isdir(self.themes_root):
+            folders += [os.path.join(self.themes_root, d, self.bg_folder_name) for d in os.listdir(self.themes_root)
+                        if not d.startswith('.')]
+        for folder in folders:
+            for dir_path, dir_names, file_names in os.walk(folder):
+                sources += [os.path.join(dir_path, name) for name in file_names
+                            if name.lower().endswith(PREVIEW_EXTENSIONS)]
+        return sources
+
+    def plan(self, source, force=False):
+        """Returns the preview paths source is missing, keyed by width, or None if its previews are fresh."""
+        rel = os.path.relpath(source, self.themes_root)
+        mtime = os.path.getmtime(source)
+        with self.lock:
+            entry = self.manifest.get(rel)
+        if not force and entry and entry['mtime'] == mtime and all(os.path.exists(os.path.join(self.store_root, p))
+                                                                   for p in entry['previews'].values()):
+            return None
+        base = os.path.splitext(rel)[0] + '.jpg'
+        return {width: os.path.join(self.store_root, str(width), base) for width in PREVIEW_WIDTHS}
+
+    def record(self, source, source_size, previews):
+        """Adds a freshly generated source to the manifest, previews maps width to path."""
+        rel = os.path.relpath(source, self.themes_root)
+        with self.lock:
+            self.manifest[rel] = {
+                'mtime': os.path.getmtime(source),
+                'size': list(source_size),
+                'previews': {str(width): os.path.relpath(path, self.store_root)
+                             for width, path in previews.items() if width < source_size[0]},
+            }
+
+    def theme_sources(self, theme_name):
+        """The images find_sources returns for one theme."""
+        return [source for source in self.find_sources()
+                if theme_of_source(os.path.relpath(source, self.themes_root)) == theme_name]
+
+    def refresh(self, cancel=None, executor=None, force=False, on_built=None):
+        """
+        Regenerates stale previews and forgets deleted sources. Returns the number of sources regenerated.
+        :param executor: optional concurrent.futures executor to build the previews on, one source per task
+        :param force: regenerate every preview, even fresh ones
+        :param on_built: optional callable, called with (source, previews written, seconds) for each source
+        """
+        sources = self.find_sources()
+        plans = [(source, targets) for source in sources
+                 for targets in [self.plan(source, force)] if targets is not None]
+
+        def built():
+            # yields (source, result, error) as each source finishes, in order when run inline
+            if executor is None:
+                for source, targets in plans:
+                    if cancel and cancel.is_set():
+                        return
+                    try:
+                        yield source, build_previews(source, targets), None
+                    except OSError as e:
+                        yield source, None, e
+                return
+            submitted = {executor.submit(build_previews, source, targets): source for source, targets in plans}
+            for future in futures.as_completed(submitted):
+                if cancel and cancel.is_set():
+                    for pending in submitted:
+                        pending.cancel()
+                    return
+                try:
+                    yield submitted[future], future.result(), None
+                except OSError as e:
+                    yield submitted[future], None, e
+
+        regenerated = 0
+        for source, result, error in built():
+            if error:
+                print(f'Unable to generate previews for {source}: {error}')
+                continue
+            source_size, targets, seconds = result
+            self.record(source, source_size, targets)
+            regenerated += 1
+            if on_built:
+                on_built(source, targets, seconds)
+
+        wanted = {os.path.relpath(source, self.themes_root) for source in sources}
+        with self.lock:
+            for rel in [rel for rel in self.manifest if rel not in wanted]:
+                for preview in self.manifest.pop(rel)['previews'].values():
+                    path = os.path.join(self.store_root, preview)
+                    if os.path.exists(path):
+                        os.remove(path)
+        self.save()
+        return regenerated
+
+    def save(self):
+        with self.lock:
+            manifest = json.dumps(self.manifest)
+        try:
+            os.makedirs(self.store_root, exist_ok=True)
+            with open(self.manifest_file + '.tmp', 'w') as file:
+                file.write(manifest)
+            os.replace(self.manifest_file + '.tmp', self.manifest_file)
+        except OSError as e:
+            print(f'Unable to save preview manifest {self.manifest_file}: {e}')
+
+    def best(self, source, width, height):
+        """Returns the smallest fresh preview of source that covers a width x height window, or source itself."""
+        with self.lock:
+            entry = self.manifest.get(os.path.relpath(source, self.themes_root))
+        if not entry or not entry['previews'] or entry['mtime'] != self.mtime_of(source):
+            return source
+
+        source_width, source_height = entry['size']
+        shown_width = source_width * min(width / source_width, height / source_height)
+        for preview_width in sorted(entry['previews'], key=int):
+            if int(preview_width) >= shown_width:
+                path = os.path.join(self.store_root, entry['previews'][preview_width])
+                return path if os.path.exists(path) else source
+        return source
+
+
+class ConfigLine:
+    """
+    One line of a rEFInd config file, split so it can be rewritten without disturbing its layout:
+    indent + directive + separator + value + rest, where rest is any trailing comment and the line ending.
+    Like rEFInd, the separator can be spaces, tabs or an equals sign. Blank and comment lines have no
+    directive and are written back untouched.
+    """
+    LINE_RE = re.compile(r'^([ \t]*)([^\s#=]+)([ \t=]*)([^#\r\n]*?)([ \t]*(?:#[^\r\n]*)?(?:\r?\n)?)$')
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.directive = None
+        match = self.LINE_RE.match(raw)
+        if match:
+            self.indent, self.token, self.separator, self.value, self.rest = match.groups()
+            self.directive = self.token.lower()  # for lookups, the line keeps the token as it was written
+
+    def set_value(self, value):
+        self.value = value
+        # a directive that had no value still needs something between it and the new value
+        self.raw = f'{self.indent}{self.token}{self.separator or " "}{value}{self.rest}'
+
+
+class RefindConfig:
+    """
+    Parsed rEFInd config (theme.conf or refind.conf). Comments, blank lines and layout are kept as written,
+    edits are made in memory and save() writes the file once, atomically, and only if something changed.
+    Lookups and edits follow include lines into the included files, one level deep like rEFInd itself.
+    """
+    def __init__(self, path, text='', follow_includes=True):
+        self.path = path
+        self.lines = [ConfigLine(line) for line in text.splitlines(keepends=True)]
+        self.mtime = None
+        self.dirty = False
+        self.follow_includes = follow_includes
+        self.included = {}  # path -> RefindConfig of each included file, loaded on first lookup
+
+    @classmethod
+    def load(cls, path, follow_includes=True):
+        with open(path, 'r') as file:
+            config = cls(path, file.read(), follow_includes)
+        config.mtime = os.path.getmtime(path)
+        return config
+
+    def directives(self, directive):
+        """Lines setting directive in the order rEFInd reads them, included files' lines where they're included."""
+        directive = directive.lower()
+        found = []
+        for line in self.lines:
+            if line.directive == directive:
+                found.append(line)
+            elif line.directive == 'include' and self.follow_includes:
+                included = self.include(line.value)
+                if included:
+                    found += included.directives(directive)
+        return found
+
+    def include(self, value):
+        """The config an include line pulls in, relative to this file's folder. None if it doesn't exist."""
+        path = os.path.join(os.path.dirname(self.path or ''), value.strip().strip('"'))
+        config = self.included.get(path)
+        if not os.path.isfile(path):
+            config = None
+        elif config is None or config.mtime != os.path.getmtime(path):
+            config = RefindConfig.load(path, False)
+        self.included[path] = config
+        return config
+
+    def get(self, directive, default=None):
+        """Value of a directive, rEFInd uses the last one when a directive is repeated."""
+        lines = self.directives(directive)
+        return lines[-1].value if lines else default
+
+    def set(self, directive, value):
+        """
+        Sets every occurrence of directive to value, in included files too, appending it to this file if it
+        isn't anywhere yet.
+        """
+        if not self.directives(directive):
+            if self.lines and not self.lines[-1].raw.endswith('\n'):
+                self.lines[-1].raw += '\n'
+            self.lines.append(ConfigLine(f'{directive} {value}\n'))
+            self.dirty = True
+            return
+        for config in self.configs():
+            for line in config.lines:
+                if line.directive == directive.lower() and line.value != value:
+                    line.set_value(value)
+                    config.dirty = True
+
+    def configs(self):
+        """This config followed by every included config that exists."""
+        return [self] + [config for config in self.included.values() if config]
+
+    def text(self):
+        return ''.join(line.raw for line in self.lines)
+
+    def save(self):
+        """
+        Writes the config, and any included config that was edited through it, if it changed. Each file is
+        written via a temporary file and rename so it is never half written.
+        """
+        changed = [config for config in self.configs() if config.dirty]
+        if not changed:
+            return False
+        with tracer.span('config write'):
+            for config in changed:
+                config._write()
+        return True
+
+    def _write(self):
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w') as file:
+            file.write(self.text())
+            file.flush()
+            os.fsync(file.fileno())
+        if os.path.exists(self.path):
+            shutil.copymode(self.path, temp_path)
+        os.replace(temp_path, self.path)
+        self.mtime = os.path.getmtime(self.path)
+        self.dirty = False
+
+
+class ConfigStore:
+    """Keeps one parsed RefindConfig per file, reloading it only when the file changed on disk."""
+    def __init__(self):
+        self.configs = {}
+        self.lock = threading.Lock()
+
+    def get(self, path):
+        with self.lock:
+            config = self.configs.get(path)
+            if config is None or config.mtime != os.path.getmtime(path):
+                config = self.configs[path] = RefindConfig.load(path)
+            return config
+
+
+class ThemeInfo:
+    """Everything the viewer needs about one theme, gathered once by the ThemeCatalogue."""
+    def __init__(self, name, path, config_file):
+        self.name = name
+        self.path = path
+        self.config_file = config_file
+        self.bg_images = []  # sample backgrounds the user can cycle through with up/down
+        self.preview = None  # single preview image used when there are no backgrounds
+        self.image_mtimes = {}  # path -> mtime of bg_images and preview
+        self.image_sizes = {}  # path -> (width, height) of bg_images and preview
+        self.icon_dirs = []
+        self.size_bytes = 0
+        self.file_count = 0
+        self.tree_hash = None  # sha1 of every file's relative path, size and mtime
+        self.signature = None  # mtimes the entry was built from, see ThemeCatalogue.signature()
+
+    def to_dict(self):
+        return dict(vars(self))
+
+    @classmethod
+    def from_dict(cls, data):
+        theme = cls(data['name'], data['path'], data['config_file'])
+        vars(theme).update(data)
+        theme.image_sizes = {path: tuple(size) for path, size in theme.image_sizes.items()}
+        return theme
+
+
+class ThemeCatalogue:
+    """
+    Index of the theme library, built with os.scandir and refreshed incrementally: a theme is only rescanned
+    when the mtime of its folder or of its samples changes, e.g. after an install or delete. Navigation reads
+    everything it needs from here instead of listing folders on every keypress. With a cache_file the index
+    is persisted, so a cold start only stats each theme instead of walking the whole library.
+    """
+    def __init__(self, themes_root, sample_root, cache_file=None):
+        self.themes_root = themes_root
+        self.sample_root = sample_root
+        self.cache_file = cache_file
+        self.themes = {}  # name -> ThemeInfo
+        self.names = []
+        self.image_mtimes = {}  # path -> mtime of every catalogued preview image
+        self.image_sizes = {}  # path -> (width, height) of every catalogued preview image
+        self.rescanned = 0  # themes scanned by the last refresh
+        self.dirty = False
+        self.lock = threading.Lock()
+        if cache_file:
+            self.load()
+
+    def load(self):
+        """Loads the persisted index, refresh() then validates every entry against the disk."""
+        if not os.path.exists(self.cache_file):
+            return
+        try:
+            with open(self.cache_file, 'r') as file:
+                data = json.load(file)
+            if data.get('version') != CATALOGUE_VERSION or data.get('themes_root') != self.themes_root:
+                return
+            self.themes = {name: ThemeInfo.from_dict(theme) for name, theme in data['themes'].items()}
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            print(f'Ignoring unreadable catalogue cache {self.cache_file}: {e}')
+            self.themes = {}
+
+    def save(self):
+        if not self.cache_file or not self.dirty:
+            return
+        with self.lock:
+            data = {'version': CATALOGUE_VERSION, 'themes_root': self.themes_root,
+                    'themes': {name: theme.to_dict() for name, theme in self.themes.items()}}
+        try:
+            os.makedirs(os.path.dirname(self.cache_file), exist_ok=True)
+            with open(self.cache_file + '.tmp', 'w') as file:
+                json.dump(data, file)
+            os.replace(self.cache_file + '.tmp', self.cache_file)
+            self.dirty = False
+        except OSError as e:
+            print(f'Unable to save catalogue cache {self.cache_file}: {e}')
+
+    def get(self, name):
+        return self.themes.get(name)
+
+    def __len__(self):
+        return len(self.names)
+
+    def refresh(self):
+        """Rescans themes whose folders changed, adds new ones and forgets deleted ones. Returns the names."""
+        found = {}
+        with os.scandir(self.themes_root) as entries:
+            for entry in entries:
+                # hidden folders hold caches and the content store, samples holds previews, neither is a theme
+                if entry.name.startswith('.') or entry.path == self.sample_root or not entry.is_dir():
+                    continue
+                found[entry.name] = entry.path
+
+        themes = {}
+        self.rescanned = 0
+        for name, path in found.items():
+            signature = self.signature(name, path)
+            theme = self.themes.get(name)
+            if theme is None or theme.signature != signature or theme.path != path:
+                theme = self.scan_theme(name, path)
+                self.rescanned += 1
+                if theme is None:
+                    continue
+                theme.signature = signature
+            themes[name] = theme
+
+        image_mtimes = {}
+        image_sizes = {}
+        for theme in themes.values():
+            image_mtimes.update(theme.image_mtimes)
+            image_sizes.update(theme.image_sizes)
+        with self.lock:
+            self.dirty = self.dirty or self.rescanned > 0 or themes.keys() != self.themes.keys()
+            self.themes = themes
+            self.names = sorted(themes)
+            self.image_mtimes = image_mtimes
+            self.image_sizes = image_sizes
+        self.save()
+        return self.names
+
+    def add(self, name):
+        """Scans one new theme into the catalogue without rescanning the others, e.g. right after an import."""
+        path = os.path.join(self.themes_root, name)
+        theme = self.scan_theme(name, path)
+        if theme is None:
+            return None
+        theme.signature = self.signature(name, path)
+        with self.lock:
+            self.themes[name] = theme
+            self.names = sorted(self.themes)
+            self.image_mtimes.update(theme.image_mtimes)
+            self.image_sizes.update(theme.image_sizes)
+            self.dirty = True
+        self.save()
+        return theme
+
+    def signature(self, name, path):
+        """Cheap fingerprint of a theme: the mtimes of its folder and of its sample images."""
+        return [self._stat_mtime(path),
+                self._stat_mtime(os.path.join(self.sample_root, name)),
+                self._stat_mtime(os.path.join(self.sample_root, f'{name}.png'))]
+
+    def scan_theme(self, name, path):
+        config_file = next((os.path.join(path, c) for c in THEME_CONFIG_NAMES
+                            if os.path.isfile(os.path.join(path, c))), None)
+        if config_file is None:
+            print(f'Skipping "{name}", it has no {" or ".join(THEME_CONFIG_NAMES)}')
+            return None
+
+        theme = ThemeInfo(name, path, config_file)
+        digest = hashlib.sha1()
+        self._scan_files(theme, path, path, digest)
+        theme.tree_hash = digest.hexdigest()
+
+        bg_dir = os.path.join(self.sample_root, name)
+        if os.path.isdir(bg_dir):
+            with os.scandir(bg_dir) as entries:
+                theme.bg_images = sorted(f'{bg_dir}/{e.name}' for e in entries if e.is_file())
+
+        screenshot_path = os.path.join(self.sample_root, f'{name}.png')
+        background_path = os.path.join(self.themes_root, 'background.png')
+        theme.preview = next((p for p in (screenshot_path, background_path) if os.path.exists(p)), None)
+        for image in theme.bg_images + ([theme.preview] if theme.preview else []):
+            theme.image_mtimes[image] = self._stat_mtime(image)
+            try:
+                # only reads the header, the pixels are decoded later and only if the image is shown
+                with Image.open(image) as header:
+                    theme.image_sizes[image] = header.size
+            except OSError:
+                pass
+        return theme
+
+    def _scan_files(self, theme, root, path, digest):
+        has_icons = False
+        with os.scandir(path) as entries:
+            for entry in sorted(entries, key=lambda e: e.name):
+                if entry.is_dir(follow_symlinks=False):
+                    self._scan_files(theme, root, entry.path, digest)
+                elif entry.is_file():
+                    stat = entry.stat()
+                    theme.file_count += 1
+                    theme.size_bytes += stat.st_size
+                    digest.update(f'{os.path.relpath(entry.path, root)}\0{stat.st_size}\0{stat.st_mtime}\n'.encode())
+                    has_icons = has_icons or (entry.name.startswith(('os_', 'func_')) and entry.name.endswith('.png'))
+        if has_icons:
+            theme.icon_dirs.append(path)
+
+    def mtime_of(self, path):
+        """Recorded mtime of a catalogued image, anything else is looked up on disk. None if it doesn't exist."""
+        mtime = self.image_mtimes.get(path)
+        return mtime if mtime is not None else self._stat_mtime(path)
+
+    def image_size(self, path):
+        """Recorded (width, height) of a catalogued image, None for anything else."""
+        return self.image_sizes.get(path)
+
+    @staticmethod
+    def _stat_mtime(path):
+        try:
+            return os.stat(path).st_mtime
+        except OSError:
+            return None
+
+
+def clean_theme_name(name):
+    """Theme name from an archive or folder name, without the extension and GitHub's download decorations."""
+    for extension in ARCHIVE_EXTENSIONS:
+        if name.lower().endswith(extension):
+            name = name[:-len(extension)]
+            break
+    return re.sub(r'^refind[-_]theme[-_]|[-_](main|master)$', '', name, flags=re.IGNORECASE) or name
+
+
+def safe_member_path(name):
+    """Path of an archive member relative to where it is extracted, None if it would land outside of it."""
+    path = name.replace('\\', '/')
+    parts = [part for part in path.split('/') if part not in ('', '.')]
+    if not parts or path.startswith('/') or '..' in parts or ':' in parts[0]:
+        return None
+    return os.path.join(*parts)
+
+
+def iter_archive(archive_path):
+    """
+    Yields (member name, file object) for every regular file in a zip or tar archive, reading it as a stream.
+    Links, devices and other special members are never extracted.
+    """
+    if zipfile.is_zipfile(archive_path):
+        with zipfile.ZipFile(archive_path) as archive:
+            for info in archive.infolist():
+                # zips made on unix keep the file type in the high bits, skip symlinks
+                if info.is_dir() or (info.external_attr >> 16) & 0o170000 == 0o120000:
+                    continue
+                with archive.open(info) as file:
+                    yield info.filename, file
+        return
+    try:
+        with tarfile.open(archive_path, 'r|*') as archive:
+            for member in archive:
+                if member.isfile():
+                    yield member.name, archive.extractfile(member)
+    except tarfile.ReadError as e:
+        raise ValueError(f'{archive_path} is not a zip or tar archive: {e}')
+
+
+def find_theme_root(folder):
+    """The shallowest folder under folder holding a theme config, archives usually wrap the theme in one."""
+    roots = [dir_path for dir_path, dir_names, file_names in os.walk(folder)
+             if any(config in file_names for config in THEME_CONFIG_NAMES)]
+    return min(roots, key=lambda path: path.count(os.sep)) if roots else None
+
+
+def import_theme_archive(archive_path, themes_root, name=None):
+    """
+    Extracts a theme archive straight into themes_root/<name>. Members are streamed into a hidden folder next
+    to the library, which is renamed into place once the archive is known to hold a valid theme, so nothing is
+    copied twice and a bad archive never shows up as a theme.
+    :return: (name, theme folder, files extracted, bytes extracted)
+    :raises ValueError: if the archive is unreadable, has no theme config or the theme already exists
+    """
+    staging = os.path.join(themes_root, f'.importing-{os.getpid()}-{threading.get_ident()}')
+    files = size = 0
+    try:
+        for member, source in iter_archive(archive_path):
+            rel_path = safe_member_path(member)
+            if rel_path is None:
+                print(f'Skipping {member!r} in {archive_path}, it would be extracted outside the theme')
+                continue
+            dest_path = os.path.join(staging, rel_path)
+            os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+            with open(dest_path, 'wb') as dest:
+                shutil.copyfileobj(source, dest, COPY_CHUNK_SIZE)
+                size += dest.tell()
+            files += 1
+
+        root = find_theme_root(staging)
+        if root is None:
+            raise ValueError(f'{archive_path} has no {" or ".join(THEME_CONFIG_NAMES)}')
+        config_file = next(os.path.join(root, c) for c in THEME_CONFIG_NAMES if os.path.isfile(os.path.join(root, c)))
+        if not any(line.directive for line in RefindConfig.load(config_file).lines):
+            raise ValueError(f'{archive_path} has an empty {os.path.basename(config_file)}')
+
+        if name is None:
+            name = clean_theme_name(os.path.basename(archive_path if root == staging else root))
+        if name.startswith('.') or name == 'samples' or os.sep in name:
+            raise ValueError(f"'{name}' can't be used as a theme name")
+        theme_dir = os.path.join(themes_root, name)
+        if os.path.exists(theme_dir):
+            raise ValueError(f"A theme named '{name}' already exists")
+        os.rename(root, theme_dir)
+        return name, theme_dir, files, size
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+
+
+def add_theme_sample(name, theme_dir, sample_root):
+    """Uses the theme's own screenshot (or background) as its sample image when it has none yet."""
+    sample = os.path.join(sample_root, f'{name}.png')
+    if os.path.exists(sample) or os.path.isdir(os.path.join(sample_root, name)):
+        return None
+    images = sorted(entry.name for entry in os.scandir(theme_dir) if entry.is_file()
+                    and entry.name.lower().endswith('.png'))
+    source = next((image for image in images if image.lower().startswith('screenshot')),
+                  'background.png' if 'background.png' in images else None)
+    if source is None:
+        return None
+    os.makedirs(sample_root, exist_ok=True)
+    copy_file(os.path.join(theme_dir, source), sample)
+    return sample
+
+
+def import_theme(archive_path, themes_root, sample_root, store_root, name=None):
+    """
+    Imports one archive and builds the previews of the new theme. Module level so batch imports can run it in
+    worker processes, the preview records are returned for the parent to add to its PreviewStore.
+    :return: (name, files, bytes, preview records, seconds)
+    """
+    start = time.perf_counter()
+    name, theme_dir, files, size = import_theme_archive(archive_path, themes_root, name)
+    add_theme_sample(name, theme_dir, sample_root)
+    store = PreviewStore(themes_root, sample_root, store_root)
+    records = []
+    for source in store.theme_sources(name):
+        try:
+            source_size, targets, seconds = build_previews(source, store.plan(source, force=True))
+            records.append((source, source_size, targets))
+        except OSError as e:
+            print(f'Unable to generate previews for {source}: {e}')
+    return name, files, size, records, time.perf_counter() - start
+
+
+def import_theme_archives(archives, themes_root, sample_root, preview_store, catalogue, jobs=None, name=None):
+    """
+    Imports a batch of theme archives, in parallel across a process pool when there is more than one, and adds
+    each theme to the catalogue and preview store as it lands.
+    :return: (imported, errors), imported holds (archive, name, files, bytes, seconds), errors (archive, error)
+    """
+    failures = (ValueError, OSError, zipfile.BadZipFile, tarfile.TarError)
+    imported = []
+    errors = []
+
+    def add(archive, result):
+        theme_name, files, size, records, seconds = result
+        for record in records:
+            preview_store.record(*record)
+        catalogue.add(theme_name)
+        imported.append((archive, theme_name, files, size, seconds))
+
+    if len(archives) > 1 and jobs != 1:
+        # forking a process that runs Tk and worker threads can deadlock the children, so they're started
+        # from a clean forkserver process instead, import_theme is importable there from the module
+        context = multiprocessing.get_context('forkserver')
+        with futures.ProcessPoolExecutor(max_workers=jobs, mp_context=context) as pool:
+            submitted = {pool.submit(import_theme, archive, themes_root, sample_root, preview_store.store_root): archive
+                       for archive in archives}
+            for future in futures.as_completed(submitted):
+                try:
+                    add(submitted[future], future.result())
+                except failures as e:
+                    errors.append((submitted[future], e))
+    else:
+        for archive in archives:
+            try:
+                add(archive, import_theme(archive, themes_root, sample_root, preview_store.store_root, name))
+            except failures as e:
+                errors.append((archive, e))
+    preview_store.save()
+    return imported, errors
+
+
+class ThumbnailGrid:
+    """
+    Scrollable grid of theme and background thumbnails shown over the carousel. Only the tiles inside the
+    viewport exist as canvas items and they are recycled as the user scrolls. Thumbnails are decoded on the
+    background worker and kept in a bounded cache, so scrolling a big library stays smooth.
+    """
+    TILE_WIDTH = THUMB_SIZE[0] + THUMB_PADDING
+    TILE_HEIGHT = THUMB_SIZE[1] + THUMB_LABEL_HEIGHT + THUMB_PADDING
+
+    def __init__(self, app):
+        self.app = app
+        self.frame = tk.Frame(app.root, bg="black")
+        self.canvas = tk.Canvas(self.frame, bg="black", highlightthickness=0)
+        self.scrollbar = tk.Scrollbar(self.frame, orient="vertical", command=self.on_scrollbar)
+        self.canvas.config(yscrollcommand=self.scrollbar.set)
+        self.scrollbar.pack(side="right", fill="y")
+        self.canvas.pack(side="left", fill="both", expand=True)
+        self.canvas.bind("<Configure>", lambda e: self.layout())
+        self.canvas.bind("<Button-1>", self.on_click)
+        for sequence in ("<MouseWheel>", "<Button-4>", "<Button-5>"):
+            self.canvas.bind(sequence, self.on_wheel)
+
+        self.items = []  # (theme index, bg index, image path, caption) per tile
+        self.tiles = []  # recycled (rectangle, image, text) canvas items
+        self.tile_photos = {}  # slot -> PhotoImage shown in it, Tk drops images nothing references
+        self.slot_of = {}  # item index -> slot, for the tiles currently on screen
+        self.photos = LRUCache('thumbnails', THUMB_CACHE_BYTES)
+        self.columns = 1
+        self.visible = False
+
+    def build_items(self):
+        items = []
+        for theme_index, name in enumerate(self.app.themes):
+            theme = self.app.catalogue.get(name)
+            if theme.bg_images:
+                for bg_index, path in enumerate(theme.bg_images):
+                    bg_name = os.path.splitext(os.path.basename(path))[0]
+                    items.append((theme_index, bg_index, path, f'{name.title()}: {bg_name.title()}'))
+            else:
+                items.append((theme_index, 0, theme.preview or self.app.ERROR_IMAGE, name.title()))
+        return items
+
+    def show(self):
+        self.items = self.build_items()
+        self.visible = True
+        self.frame.place(x=0, y=0, relwidth=1, relheight=1)
+        self.frame.lift()
+        self.canvas.focus_set()
+        self.layout()
+        # start with the current theme in view
+        current = next((i for i, item in enumerate(self.items) if item[0] == self.app.theme_index), 0)
+        rows = max(1, -(-len(self.items) // self.columns))
+        self.canvas.yview_moveto((current // self.columns) / rows)
+        self.render()
+
+    def hide(self):
+        self.visible = False
+        self.app.worker.cancel("thumbnails")
+        self.frame.place_forget()
+        self.app.root.focus_set()
+
+    def layout(self):
+        if not self.visible:
+            return
+        self.columns = max(1, self.canvas.winfo_width() // self.TILE_WIDTH)
+        rows = -(-len(self.items) // self.columns)
+        self.canvas.config(scrollregion=(0, 0, self.columns * self.TILE_WIDTH, rows * self.TILE_HEIGHT))
+        self.render()
+
+    def visible_range(self):
+        top = self.canvas.canvasy(0)
+        bottom = top + self.canvas.winfo_height()
+        first = int(top // self.TILE_HEIGHT) * self.columns
+        last = (int(bottom // self.TILE_HEIGHT) + 1) * self.columns
+        return max(first, 0), min(last, len(self.items))
+
+    def render(self):
+        """Points the pooled tiles at the items in the viewport and queues thumbnails that aren't cached."""
+        if not self.visible:
+            return
+        first, last = self.visible_range()
+        while len(self.tiles) < last - first:
+            self.tiles.append((self.canvas.create_rectangle(0, 0, 0, 0, fill="#222", outline=""),
+                               self.canvas.create_image(0, 0, anchor="nw"),
+                               self.canvas.create_text(0, 0, anchor="n", fill="white", font=("Helvetica", 10))))
+
+        self.slot_of = {}
+        missing = []
+        for slot, index in enumerate(range(first, last)):
+            theme_index, bg_index, path, caption = self.items[index]
+            rectangle, image, text = self.tiles[slot]
+            x = (index % self.columns) * self.TILE_WIDTH + THUMB_PADDING // 2
+            y = (index // self.columns) * self.TILE_HEIGHT + THUMB_PADDING // 2
+            selected = theme_index == self.app.theme_index and bg_index == self.app.bg_index
+            self.canvas.coords(rectangle, x, y, x + THUMB_SIZE[0], y + THUMB_SIZE[1])
+            self.canvas.itemconfig(rectangle, state="normal", outline="white" if selected else "")
+            self.canvas.coords(image, x, y)
+            self.canvas.coords(text, x + THUMB_SIZE[0] // 2, y + THUMB_SIZE[1] + 4)
+            self.canvas.itemconfig(text, text=caption, state="normal")
+
+            photo = self.photos.get(path)
+            self.tile_photos[slot] = photo
+            self.canvas.itemconfig(image, image=photo if photo else "", state="normal")
+            self.slot_of[index] = slot
+            if photo is None:
+                missing.append(index)
+
+        for slot in range(last - first, len(self.tiles)):
+            self.tile_photos.pop(slot, None)
+            for item in self.tiles[slot]:
+                self.canvas.itemconfig(item, state="hidden")
+
+        if missing:
+            self.request_thumbnails(missing)
+
+    def request_thumbnails(self, indices):
+        app = self.app
+        width, height = THUMB_SIZE
+        paths = [(index, self.items[index][2]) for index in indices]
+
+        def generate(job):
+            for index, path in paths:
+                if job.cancelled():
+                    return
+                if app.catalogue.mtime_of(path) is None:
+                    continue
+                job.progress(index, path, app.previews.frame(app.preview_store.best(path, width, height), width, height))
+
+        def generated(index, path, frame):
+            photo = ImageTk.PhotoImage(frame)
+            self.photos.put(path, photo, image_size_bytes(frame))
+            slot = self.slot_of.get(index)
+            if self.visible and slot is not None:
+                self.tile_photos[slot] = photo
+                self.canvas.itemconfig(self.tiles[slot][1], image=photo)
+
+        # scrolling on cancels the batch for tiles that have already left the viewport
+        app.worker.submit("thumbnails", generate, on_progress=generated)
+
+    def on_scrollbar(self, *args):
+        self.canvas.yview(*args)
+        self.render()
+
+    def on_wheel(self, event):
+        if getattr(event, 'num', None) == 4 or getattr(event, 'delta', 0) > 0:
+            self.canvas.yview_scroll(-1, "units")
+        else:
+            self.canvas.yview_scroll(1, "units")
+        self.render()
+
+    def on_click(self, event):
+        column = int(self.canvas.canvasx(event.x) // self.TILE_WIDTH)
+        index = int(self.canvas.canvasy(event.y) // self.TILE_HEIGHT) * self.columns + column
+        if column >= self.columns or not 0 <= index < len(self.items):
+            return
+        theme_index, bg_index, path, caption = self.items[index]
+        self.hide()
+        self.app.theme_index = theme_index
+        self.app.bg_index = bg_index
+        self.app.display_theme()
+
+
+class ThemeSelectorApp:
+    def __init__(self, root, refind_root=None, hud=False):
+        print('Launching skin selector...')
+        self.REFIND_ROOT = refind_root if refind_root else DEFAULT_REFIND_ROOT
+        self.REFIND_THEME_ROOT = os.path.join(self.REFIND_ROOT, "theme")
+        # Paths Relative to Project Root
+        self.APP_ROOT = os.path.dirname(os.path.abspath(__file__))
+        self.APP_THEMES_ROOT = os.path.join(self.APP_ROOT, ".themes")  # Example: /path/to/project/.themes
+        self.SAMPLE_ROOT = os.path.join(self.APP_THEMES_ROOT, "samples")
+        self.ERROR_IMAGE = os.path.join(self.SAMPLE_ROOT, ".error.png")
+        self.BG_FOLDER_NAME = "bg"  # The folder containing background images
+        self.CACHE_ROOT = os.path.join(self.APP_THEMES_ROOT, ".cache")  # Hidden, so it is never listed as a theme
+        self.content_store = ContentStore(os.path.join(self.APP_THEMES_ROOT, STORE_DIR_NAME))
+        self.hash_cache = FileHashCache(os.path.join(self.CACHE_ROOT, "file_hashes.json"), self.content_store)
+        self.configs = ConfigStore()  # parsed theme.conf files, edited in memory and written once per apply
+        if os.path.isdir(self.REFIND_ROOT):
+            recover_theme_install(self.REFIND_THEME_ROOT)
+        self.catalogue = ThemeCatalogue(self.APP_THEMES_ROOT, self.SAMPLE_ROOT,
+                                        os.path.join(self.CACHE_ROOT, "catalogue.json"))
+
+        self.root = root
+        self.root.title("Linux rEFInd Automatic Skin Loader by E.T.A. and skin authors")
+        self.root.geometry("800x500")
+        self.root.minsize(600, 400)
+        self.root.resizable(True, True)
+
+        # Bind keys for navigation and deletion
+        self.root.bind("<Up>", lambda e: self.handle_keypress(self.next_bg))
+        self.root.bind("<Down>", lambda e: self.handle_keypress(self.prev_bg))
+        self.root.bind("<Left>", lambda e: self.handle_keypress(self.prev_theme))
+        self.root.bind("<Right>", lambda e: self.handle_keypress(self.next_theme))
+        self.root.bind("<Delete>", lambda e: self.delete_theme())
+        self.root.bind("<Return>", lambda e: self.apply_theme())
+        self.root.bind("<KP_Enter>", lambda e: self.apply_theme())
+        self.root.bind("<g>", lambda e: self.toggle_grid())
+        self.root.bind("<i>", lambda e: self.import_themes())
+        self.root.bind("<Escape>", lambda e: self.grid.hide() if self.grid.visible else None)
+        # Bind resizing events
+        self.root.bind("<Configure>", self.on_resize)
+        self.window_size = None
+        self.resize_job = None
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
+
+        # slow disk work (ESP writes, imports, deletes, the preview store) runs on disk_worker so the window
+        # never stops responding, and decoding for the screen runs on worker so a long install never delays it
+        self.worker = BackgroundWorker(self.root)
+        self.disk_worker = BackgroundWorker(self.root)
+        self.previews = PreviewCache(self.catalogue.mtime_of, self.catalogue.image_size)
+        self.preview_store = PreviewStore(self.APP_THEMES_ROOT, self.SAMPLE_ROOT,
+                                          os.path.join(self.CACHE_ROOT, "previews"), self.BG_FOLDER_NAME,
+                                          self.catalogue.mtime_of)
+        self.disk_worker.submit("previews", lambda job: self.preview_store.refresh(job.cancel_event),
+                                on_done=lambda count: print(f'Regenerated previews for {count} images'))
+
+        # every keypress moves the selection, only the latest selection is rendered once the Tk loop is idle
+        self.render_job = None
+        self.last_action = None
+        self.last_keypress_time = 0
+        self.key_repeats = 0  # how long the current arrow has been held, for key repeat acceleration
+        self.keypress_start = None  # first press not painted yet, only tracked while tracing
+
+        # attributes for each theme
+        self.themes = self.list_themes()
+        self.theme_name = ''
+        self.theme_dir = ''
+        self.theme_index = 0
+        self.theme_config_file = ''
+
+        # browsing only renders previews, the theme + background last written to the ESP is tracked here
+        self.applied_theme = None
+        self.applied_bg = None
+        self.applying = None  # (theme, bg) being written by the worker
+
+        # attributes for image background (if applicable)
+        self.bg_name = ''
+        self.bg_images = None
+        self.bg_dir = None
+        self.bg_caption = None
+        self.bg_index = 0  # Current background index
+
+        # attributes for image
+        self.current_image = ''
+        self.current_image_name = ''
+        self.current_image_dir = ''
+
+        # widgets: labels
+        self.image_label = tk.Label(self.root, bg="black")
+        self.image_label.pack(fill="both", expand=True)
+        self.theme_name_label = tk.Label(self.root, text="", font=("Helvetica", 16, "bold"), bg="black", fg="white")
+        self.theme_name_label.pack(side="bottom", fill="x")
+        self.status_label = tk.Label(self.root, text="", font=("Helvetica", 10), bg="black", fg="#aaa")
+        self.status_label.place(relx=0.01, rely=0.99, anchor="sw")
+
+        # widgets: buttons
+        self.left_button = tk.Button(self.root, text="◀", command=self.prev_theme, font=("Helvetica", 20), bg="#444", fg="white", relief=tk.FLAT)
+        self.left_button.place(x=20, rely=0.5, anchor="w", width=50, height=50)
+        self.right_button = tk.Button(self.root, text="▶", command=self.next_theme, font=("Helvetica", 20), bg="#444", fg="white", relief=tk.FLAT)
+        self.right_button.place(relx=0.99, rely=0.5, anchor="e", width=50, height=50)
+        self.apply_button = tk.Button(self.root, text="Apply", command=self.apply_theme, font=("Helvetica", 12, "bold"), bg="#444", fg="white", relief=tk.FLAT)
+        self.apply_button.place(relx=0.99, rely=0.99, anchor="se", width=80, height=30)
+        self.grid_button = tk.Button(self.root, text="Grid", command=self.toggle_grid, font=("Helvetica", 12, "bold"), bg="#444", fg="white", relief=tk.FLAT)
+        self.grid_button.place(relx=0.99, rely=0.01, anchor="ne", width=80, height=30)
+        self.import_button = tk.Button(self.root, text="Import", command=self.import_themes, font=("Helvetica", 12, "bold"), bg="#444", fg="white", relief=tk.FLAT)
+        self.import_button.place(relx=0.01, rely=0.01, anchor="nw", width=80, height=30)
+        # optional overlay with the latency of the last keypress, see show_latency
+        self.hud_label = None
+        if hud:
+            self.hud_label = tk.Label(self.root, text="", font=("Courier", 10), bg="black", fg="#6f6", justify="left")
+            self.hud_label.place(x=10, y=50, anchor="nw")
+        self.grid = ThumbnailGrid(self)
+
+        # show the window with a placeholder straight away, the first preview is decoded in the background
+        self.startup_timings = {}
+        self.first_image_shown = False
+        self.image_label.config(text="Loading preview...", fg="white", font=("Helvetica", 14))
+        self.root.after_idle(self.show_first_theme)
+
+    def show_first_theme(self):
+        self.root.update_idletasks()  # make sure the window geometry is known before sizing the first frame
+        self.record_startup_timing('window')
+        if not self.themes:
+            return
+
+        self.display_theme(render=False)
+        self.theme_name_label.config(text=self.theme_name.title())
+        path = self.current_image_dir
+        width = self.root.winfo_width()
+        height = self.root.winfo_height() - 50
+
+        def decode(job):
+            if self.catalogue.mtime_of(path) is not None:
+                self.previews.frame(self.preview_store.best(path, width, height), width, height)
+
+        def decoded(result):
+            self.first_image_shown = True
+            self.image_label.config(text="")
+            # only the conversion to a PhotoImage is left, the frame is already cached
+            self.update_image()
+            self.record_startup_timing('first image')
+            self.prefetch_neighbours()
+
+        self.worker.submit("render", decode, on_done=decoded, on_error=lambda e: decoded(None))
+
+    def record_startup_timing(self, name):
+        self.startup_timings[name] = (time.perf_counter() - STARTUP_TIME) * 1000
+        tracer.log(f'Startup: {name} after {self.startup_timings[name]:.0f} ms')
+
+    def exit(self, exit_msg, sleep=3):
+        # Todo make static?
+        print(exit_msg)
+        time.sleep(sleep)
+        sys.exit(0)
+
+    # Ensure the script is running with sudo privileges
+    def get_permission(self):
+        if os.geteuid() != 0:
+            print("Root privileges are required. Attempting to relaunch as root...")
+            try:
+                subprocess.check_call(['sudo', sys.executable] + sys.argv)
+            except subprocess.CalledProcessError:
+                exit("Failed to gain root privileges. Exiting.")
+            # Todo check if this is needed? Does it close the lowered terminal instance, perhaps?
+            sys.exit(0)
+
+    def refind_root(self):
+        """
+        Get or set refind root (TODO)
+        :return:
+        """
+        # request the refind configuration file directory from the user using an open file dialog
+        # Todo add open file dialog - LOL
+        return self.REFIND_ROOT
+
+    def check_dirs(self):
+        # Todo test this by restarting PC and checking app functionality
+        """Ensure the themes directory and refind.conf exist."""
+
+        # boolean shorthand
+        conf_found = os.path.exists(self.theme_config_file)
+        themes_found = os.path.exists(self.APP_THEMES_ROOT)
+        print(f'\nConfig: {self.REFIND_ROOT}\nApp themes: {self.APP_THEMES_ROOT}')
+
+        if conf_found and themes_found:
+            return
+
+        print('\nUnable to find launch files... attempting to install...\n')
+
+        if not os.path.exists(self.APP_THEMES_ROOT):
+            exit('Unable to locate themes directory!')
+
+        # if passed/default refind config is not found, reinstall refind files
+        if not os.path.exists(self.REFIND_ROOT):
+            subprocess.check_call(['apt', 'install'])
+            subprocess.check_call(['refind-install'])
+
+        # if refind config files still can't be found after reinstall, ask user for dir
+        if not os.path.exists(self.REFIND_ROOT):
+            self.refind_root()
+
+        # Todo instead of crying about this being pointless, consider adding an option to drag config file onto app or
+        # add a button to load it manually that disappears on load. A warning label can appear so the user can still
+        # browse as per normal but they are aware that nothing is being set because the refind file couldn't be found
+
+        # if user provides invalid path to the refind conf, this application cannot apply skins - pointless.
+        if not os.path.exists(self.REFIND_ROOT):
+            exit('Unable to locate the refind configuration file!')
+
+    def update_config(self, theme_name, theme_config_file, bg_name):
+        """Edits the theme.conf to apply the selected background. Safe to call from the worker thread."""
+        # with open(self.REFIND_CONFIG_FILE, 'r') as file:
+        #     lines = file.readlines()
+        #
+        # themes_query = 'include '
+        # new_theme = f"{themes_query}{self.APP_THEMES_ROOT}/{self.theme_name}/theme.conf\n"
+        # print('New theme to include: ' + new_theme)
+        #
+        # if themes_query in lines[-1]:
+        #     lines[-1] = new_theme
+        # else:
+        #     lines.append(new_theme)
+
+        # if this skin has multiple backgrounds...
+        if bg_name:
+            set_theme_background(theme_config_file, theme_name, bg_name, self.configs, self.BG_FOLDER_NAME)
+
+        tracer.log(f"Applied theme: {theme_name}")
+
+    def list_themes(self):
+        """Fetches the list of themes from the themes directory."""
+        if not os.path.exists(self.APP_THEMES_ROOT):
+            print("Themes directory does not exist. Creating...")
+            os.makedirs(self.APP_THEMES_ROOT, exist_ok=True)
+
+        # only themes whose folders changed since the last call are rescanned
+        themes = list(self.catalogue.refresh())
+
+        if not themes:
+            exit('No themes found in the directory.')
+
+        print(f'Total themes found: {len(themes)} ({self.catalogue.rescanned} rescanned)')
+        return themes
+
+    def get_sample_image_dir(self):
+        """Returns the path to the theme's image or a fallback."""
+        # if the path leads to a folder of images
+        if self.bg_images:
+            return self.bg_images[self.bg_index]
+
+        preview = self.catalogue.get(self.theme_name).preview
+        if preview:
+            return preview
+        tracer.log(f'No image found for theme "{self.theme_name}", using fallback image instead.\n Path: {self.current_image_dir}')
+        return self.ERROR_IMAGE  # Default image fallback
+
+    def get_preview_image(self, theme_name, bg_index=0):
+        """Returns the image display_theme would show for theme_name without changing the current selection."""
+        theme = self.catalogue.get(theme_name)
+        if theme.bg_images:
+            return theme.bg_images[bg_index % len(theme.bg_images)]
+        return theme.preview if theme.preview else self.ERROR_IMAGE
+
+    def get_bg_images(self):
+        # if the current theme has multiple backgrounds
+        bg_images = self.catalogue.get(self.theme_name).bg_images
+        if bg_images:
+            # the index is carried over from the previous theme, which may have had more backgrounds
+            self.bg_index %= len(bg_images)
+            return list(bg_images)
+        else:
+            tracer.log('This image has no backgrounds, refreshing old background attributes...')
+            return self.bg_refresh_attributes()
+
+    def get_bg_name(self):
+        if self.bg_images:
+            match = re.search(r"(.+)/(.+)\.png", self.bg_images[self.bg_index])
+            if match:
+                # returns the text between the '/' and '.png' of the bg_dir
+                return match.group(2)
+
+    def show_bg_navigation(self):
+        """Show the up/down arrows and caption when backgrounds exist."""
+        self.root.bind("<Up>", lambda e: self.handle_keypress(self.next_bg))
+        self.root.bind("<Down>", lambda e: self.handle_keypress(self.prev_bg))
+
+        if not hasattr(self, 'bg_caption'):  # Create bg_caption if it doesn't exist
+            self.bg_caption = tk.Label(self.root, text="", font=("Helvetica", 12), bg="black", fg="white")
+            self.bg_caption.place(relx=0.95, rely=0.95, anchor="se")
+
+        self.update_bg_caption()
+
+    def hide_bg_navigation(self):
+        """Hide the up/down arrows and caption when backgrounds don't exist."""
+        self.root.unbind("<Up>")
+        self.root.unbind("<Down>")
+        self.update_bg_caption()
+
+    def update_bg_caption(self):
+        """Update the caption for the current background index."""
+        pass
+        # if hasattr(self, 'bg_caption') and self.bg_images:
+        #     self.bg_caption.config(text=f"Background {self.bg_index + 1}/{len(self.bg_images)}")
+
+    ############ OLD CLASS START #############
+
+    def handle_keypress(self, action):
+        """Moves the selection straight away, held keys speed up in big libraries. Rendering is left to schedule_render."""
+        if self.grid.visible:
+            return
+        now = time.perf_counter()
+        if action == self.last_action and now - self.last_keypress_time <= KEY_REPEAT_GAP:
+            self.key_repeats += 1
+        else:
+            self.key_repeats = 0
+        self.last_action = action
+        self.last_keypress_time = now
+        if tracer.enabled and self.keypress_start is None:
+            self.keypress_start = now
+            tracer.mark()
+        action(self.repeat_step(action))
+        if self.render_job is None:
+            self.keypress_start = None  # the key had nothing to move, there is no paint to wait for
+
+    def repeat_step(self, action):
+        """How many items one press of a held key skips, never more than a tenth of the list it moves through."""
+        count = len(self.bg_images or ()) if action in (self.next_bg, self.prev_bg) else len(self.themes)
+        step = 2 ** (self.key_repeats // KEY_ACCELERATE_EVERY)
+        return max(1, min(step, KEY_MAX_STEP, count // 10))
+
+    def show_selection(self):
+        """Updates the label for the new selection instantly and queues its preview."""
+        self.display_theme(render=False)
+        self.update_theme_label()
+        self.schedule_render()
+
+    def schedule_render(self):
+        """
+        Renders the selection once Tk has handled every pending event. Keys pressed while a preview is being
+        rendered only move the selection, so however fast they come only the latest one is ever rendered.
+        """
+        if self.render_job is None:
+            self.render_job = self.root.after_idle(self.render_selection)
+
+    def render_selection(self):
+        self.render_job = None
+        self.update_image()
+        if self.keypress_start is not None:
+            self.root.update_idletasks()  # count the paint itself as part of the latency
+            self.show_latency(time.perf_counter() - self.keypress_start)
+        self.prefetch_neighbours()
+
+    def show_latency(self, seconds):
+        """Records the keypress to paint latency and shows it, with where the time went, on the HUD."""
+        stages = '  '.join(f'{name} {spent * 1000:.1f}' for name, spent in tracer.last.items())
+        tracer.record('keypress', self.keypress_start, seconds)
+        self.keypress_start = None
+        if self.hud_label:
+            self.hud_label.config(text=f'key to paint {seconds * 1000:.1f} ms\n{stages}')
+
+    def import_themes(self):
+        """Asks for theme archives and imports them in the background, the last one imported is shown."""
+        patterns = ' '.join(f'*{extension}' for extension in ARCHIVE_EXTENSIONS)
+        archives = filedialog.askopenfilenames(title="Import rEFInd themes",
+                                               filetypes=[("Theme archives", patterns), ("All files", "*")])
+        if not archives:
+            return
+
+        def done(result):
+            imported, errors = result
+            self.themes = list(self.catalogue.names)
+            if imported:
+                self.theme_index = self.themes.index(imported[-1][1])
+                self.bg_index = 0
+                self.display_theme()
+            self.set_status(f'Imported {len(imported)} of {len(archives)} themes')
+            if errors:
+                messagebox.showerror("Import failed", "\n".join(f'{os.path.basename(archive)}: {error}'
+                                                                for archive, error in errors))
+
+        def failed(error):
+            self.set_status('')
+            messagebox.showerror("Import failed", str(error))
+
+        self.set_status(f'Importing {len(archives)} themes...')
+        self.disk_worker.submit(f"import:{archives[0]}", lambda job: import_theme_archives(
+            list(archives), self.APP_THEMES_ROOT, self.SAMPLE_ROOT, self.preview_store, self.catalogue),
+            on_done=done, on_error=failed)
+
+    def toggle_grid(self):
+        if self.grid.visible:
+            self.grid.hide()
+        elif self.themes:
+            self.grid.show()
+
+    def on_resize(self, event):
+        # <Configure> also fires for every child widget and for window moves, only a real resize matters
+        if event.widget is not self.root:
+            return
+        size = (event.width, event.height)
+        if size == self.window_size:
+            return
+        self.window_size = size
+        if not self.first_image_shown:
+            # the first preview is still being decoded in the background and is rendered at the latest size
+            return
+
+        # show a cheap frame straight away and hold off on the expensive render until the drag stops
+        self.update_image(fast=True)
+        if self.resize_job:
+            self.root.after_cancel(self.resize_job)
+        self.resize_job = self.root.after(RESIZE_SETTLE_MS, self.on_resize_settled)
+
+    def on_resize_settled(self):
+        self.resize_job = None
+        self.update_image()
+        # anything prefetched so far was rendered for the old size
+        self.prefetch_neighbours()
+
+    def bg_refresh_attributes(self):
+        self.bg_dir = ''
+        self.bg_index = 0
+        self.bg_images = None
+
+    def display_theme(self, render=True):
+        # set current theme, everything about it comes from the catalogue so navigating never scans the disk
+        with tracer.span('catalogue'):
+            self.theme_name = self.themes[self.theme_index]
+            theme = self.catalogue.get(self.theme_name)
+            self.theme_dir = theme.path
+            self.theme_config_file = theme.config_file
+            tracer.log(f'Local config folder located at: {self.theme_config_file}')
+
+            self.bg_dir = os.path.join(self.SAMPLE_ROOT, self.theme_name)
+            self.bg_images = self.get_bg_images()
+            tracer.log(f'BG IMAGES = {self.bg_images}')
+            self.bg_name = self.get_bg_name()
+
+            # Todo simplify
+            self.current_image_name = self.bg_name if self.bg_name else self.theme_name
+            self.current_image_dir = self.get_sample_image_dir()
+
+        # Show or hide up/down arrows and caption
+        if self.bg_images:
+            self.current_image_dir = self.bg_images[self.bg_index]
+            self.image_label.config(text=f"{self.bg_index + 1}/{len(self.bg_images)}")
+            self.show_bg_navigation()
+        else:
+            self.hide_bg_navigation()
+
+        # only render the preview while browsing, nothing is written to the ESP until the user applies
+        if render:
+            self.update_image()
+            self.prefetch_neighbours()
+
+    def prefetch_neighbours(self):
+        """
+        Decodes and scales the previews one step away in every direction in the background, so the next
+        arrow press only has to convert an already rendered frame.
+        """
+        width = self.root.winfo_width()
+        height = self.root.winfo_height() - 50
+        if width <= 1 or height <= 0:
+            return
+
+        paths = []
+        if self.bg_images:
+            paths += [self.bg_images[(self.bg_index + step) % len(self.bg_images)] for step in (1, -1)]
+        if self.themes:
+            paths += [self.get_preview_image(self.themes[(self.theme_index + step) % len(self.themes)], self.bg_index)
+                      for step in (1, -1)]
+        paths = [p for p in dict.fromkeys(paths) if p != self.current_image_dir]
+
+        def prefetch(job):
+            used = 0
+            for path in paths:
+                if job.cancelled() or used > PREFETCH_BUDGET_BYTES:
+                    return
+                if self.catalogue.mtime_of(path) is not None:
+                    path = self.preview_store.best(path, width, height)
+                    used += image_size_bytes(self.previews.frame(path, width, height))
+                    used += image_size_bytes(self.previews.source(path, width, height))
+
+        # a newer keypress cancels this one, only the neighbours of the latest selection matter
+        self.worker.submit("prefetch", prefetch)
+
+    def apply_theme(self):
+        """Writes the currently previewed theme (and background) to the rEFInd theme folder in the background."""
+        if not self.themes or not self.theme_name:
+            return
+
+        target = (self.theme_name, self.bg_name)
+        if self.is_applied() or self.applying == target:
+            print(f'Theme "{self.theme_name}" is already applied, nothing to do.')
+            return
+
+        # snapshot the selection, the user may keep browsing while the worker writes
+        theme_name, bg_name = target
+        theme_dir, config_file = self.theme_dir, self.theme_config_file
+        bg_sample = self.bg_images[self.bg_index] if self.bg_images else None
+        # with the same theme already on the ESP only the background has to change
+        background_only = (bg_name and self.applied_theme == theme_name and self.applying is None
+                           and os.path.isdir(self.REFIND_THEME_ROOT))
+
+        def install(job):
+            self.update_config(theme_name, config_file, bg_name)
+            if background_only:
+                return self.transfer_background(theme_name, theme_dir, config_file, bg_name, bg_sample)
+            bg_source = self.background_source(theme_dir, bg_name, bg_sample) if bg_name else None
+            return self.transfer_theme_files(theme_dir, job.cancel_event, job.progress, bg_source=bg_source)
+
+        def done(report):
+            self.applying = None
+            self.update_apply_button()
+            if report.cancelled:
+                return
+            if report.errors:
+                self.set_status(f'Failed to apply {theme_name}: {len(report.errors)} errors')
+                return
+            self.applied_theme, self.applied_bg = target
+            self.set_status(f'Applied {theme_name}: {report}')
+            self.update_theme_label()
+
+        def failed(error):
+            self.applying = None
+            self.update_apply_button()
+            self.set_status(f'Failed to apply {theme_name}: {error}')
+
+        def progress(report):
+            self.set_status(f'Applying {theme_name}... {report.files_written + report.files_skipped} files')
+
+        self.applying = target
+        self.set_status(f'Applying {theme_name}...')
+        self.disk_worker.submit("esp", install, on_done=done, on_error=failed, on_progress=progress)
+        self.update_apply_button()
+
+    def is_applied(self):
+        """Returns True if the previewed theme and background are the ones currently on the ESP."""
+        return self.applied_theme == self.theme_name and self.applied_bg == self.bg_name
+
+    def update_theme_label(self):
+        label = self.current_image_name.title()
+        if self.bg_images:
+            label = f'{self.theme_name.title()}: ' + label
+        if self.is_applied():
+            label += ' (applied)'
+        self.theme_name_label.config(text=label)
+        self.update_apply_button()
+
+    def update_apply_button(self):
+        """Greys out Apply while the previewed selection is already on the ESP or still being written to it."""
+        writing = self.applying == (self.theme_name, self.bg_name) and self.disk_worker.busy("esp")
+        self.apply_button.config(state=tk.DISABLED if writing or self.is_applied() else tk.NORMAL)
+
+    def set_status(self, text):
+        self.status_label.config(text=text)
+
+    def on_close(self):
+        # a cancelled install stops before its rename swap, so the installed theme is always left intact
+        self.worker.shutdown()
+        self.disk_worker.shutdown()
+        tracer.log(f'Preview cache stats:\n{self.previews}')
+        self.root.destroy()
+
+    def update_image(self, fast=False):
+        if self.catalogue.mtime_of(self.current_image_dir) is not None:
+            try:
+                window_width = self.root.winfo_width()
+                window_height = self.root.winfo_height() - 50
+
+                # decode the smallest stored preview that covers the window rather than the full size image
+                with tracer.span('preview lookup'):
+                    path = self.preview_store.best(self.current_image_dir, window_width, window_height)
+                if fast:
+                    self.current_image = self.previews.fast_photo(path, window_width, window_height)
+                else:
+                    self.current_image = self.previews.photo(path, window_width, window_height)
+                self.image_label.config(image=self.current_image)
+                self.update_theme_label()
+                self.update_bg_caption()
+
+            except Exception as e:
+                print(f"Error resizing image: {e}")
+
+    def transfer_theme_files(self, theme_dir, cancel=None, progress=None, optimise_images=True, bg_source=None):
+        """
+        Installs theme_dir as the rEFInd theme folder via a staged copy and rename swap, the previous theme is
+        kept next to it as a rollback. Safe to call from the worker thread.
+        """
+        report = install_theme(theme_dir, self.REFIND_ROOT, self.CACHE_ROOT, self.hash_cache, optimise_images,
+                               cancel, progress, bg_source, self.configs)
+        self.hash_cache.save()
+        return report
+
+    def background_source(self, theme_dir, bg_name, bg_sample):
+        """The theme's own bg/ image for bg_name when it has one, otherwise the sample the user picked."""
+        bg_source = os.path.join(theme_dir, self.BG_FOLDER_NAME, f'{bg_name}.png')
+        return bg_source if os.path.exists(bg_source) else bg_sample
+
+    def transfer_background(self, theme_name, theme_dir, theme_config_file, bg_name, bg_sample):
+        """
+        Swaps just the background of the installed theme. Uses the theme's own bg/ image when it has one,
+        otherwise the sample the user picked, optimised like a full install would. Safe to call from the
+        worker thread.
+        """
+        bg_file = f'{bg_name}.png'
+        bg_source = self.background_source(theme_dir, bg_name, bg_sample)
+        with tracer.span('optimise'):
+            bg_source = optimised_background(bg_source, theme_dir, self.REFIND_ROOT, self.CACHE_ROOT)
+        with tracer.span('transfer'):
+            report = install_background(self.REFIND_THEME_ROOT, os.path.basename(theme_config_file), bg_source,
+                                        os.path.join(self.BG_FOLDER_NAME, bg_file),
+                                        f'themes/{theme_name}/{self.BG_FOLDER_NAME}/{bg_file}', self.hash_cache, self.configs)
+        self.hash_cache.save()
+        print(f"Switched background of '{self.REFIND_THEME_ROOT}' to {bg_file}: {report}")
+        return report
+
+    def next_theme(self, steps=1):
+        if self.themes:
+            self.theme_index = (self.theme_index + steps) % len(self.themes)
+            self.show_selection()
+
+    def prev_theme(self, steps=1):
+        self.next_theme(-steps)
+
+    def next_bg(self, steps=1):
+        if self.bg_images:
+            self.bg_index = (self.bg_index + steps) % len(self.bg_images)
+            self.show_selection()
+
+    def prev_bg(self, steps=1):
+        self.next_bg(-steps)
+
+    def delete_theme(self):
+        if not self.themes:
+            messagebox.showerror("Error", "No themes available to delete.")
+            return
+
+        theme_to_delete = self.themes[self.theme_index]
+        confirm = messagebox.askyesno("Delete Theme", f"Are you sure you want to delete the theme '{theme_to_delete}'?")
+        if not confirm:
+            return
+
+        theme_path = os.path.join(self.APP_THEMES_ROOT, theme_to_delete)
+
+        def deleted(result):
+            self.set_status('')
+            messagebox.showinfo("Success", f"Theme '{theme_to_delete}' deleted successfully.")
+
+            # Refresh the themes list
+            self.themes = self.list_themes()
+            if self.themes:
+                # update current index to 0 if there is only one item left, else se
+                self.theme_index = (self.theme_index - 1) % len(self.themes)
+                self.display_theme()
+            else:
+                self.theme_name_label.config(text="")
+                self.image_label.config(image="")
+
+        def failed(error):
+            self.set_status('')
+            messagebox.showerror("Error", f"Unable to delete theme '{theme_to_delete}': {error}")
+
+        # Delete the theme folder in the background, big themes take a while
+        self.set_status(f'Deleting {theme_to_delete}...')
+        self.disk_worker.submit(f"delete:{theme_to_delete}", lambda job: shutil.rmtree(theme_path),
+                           on_done=deleted, on_error=failed)
+
+
+def app_paths():
+    """The (themes, samples, cache) folders of this checkout, the same ones ThemeSelectorApp uses."""
+    themes_root = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".themes")
+    return themes_root, os.path.join(themes_root, "samples"), os.path.join(themes_root, ".cache")
+
+
+def theme_of_source(rel_path):
+    """Which theme a preview source belongs to, from its path relative to .themes."""
+    parts = rel_path.replace(os.sep, '/').split('/')
+    if parts[0] == 'samples':
+        return parts[1] if len(parts) > 2 else os.path.splitext(parts[1])[0]
+    return parts[0]
+
+
+def run_previews(args):
+    """Builds every stale preview in a process pool without opening the GUI and reports the throughput."""
+    themes_root, sample_root, cache_root = app_paths()
+    store = PreviewStore(themes_root, sample_root, os.path.join(cache_root, "previews"))
+    per_theme = {}  # theme -> [sources, previews written, seconds of work]
+
+    def built(source, targets, seconds):
+        stats = per_theme.setdefault(theme_of_source(os.path.relpath(source, themes_root)), [0, 0, 0.0])
+        stats[0] += 1
+        stats[1] += len(targets)
+        stats[2] += seconds
+
+    start = time.perf_counter()
+    with futures.ProcessPoolExecutor(max_workers=args.jobs) as pool:
+        regenerated = store.refresh(executor=pool, force=args.force, on_built=built)
+    elapsed = time.perf_counter() - start
+
+    for theme, (sources, previews, seconds) in sorted(per_theme.items()):
+        print(f'{theme:<24} {sources:>4} images {previews:>5} previews {seconds:>8.2f}s')
+    written = sum(stats[1] for stats in per_theme.values())
+    if not regenerated:
+        print(f'All previews are up to date ({elapsed:.2f}s to check)')
+        return 0
+    print(f'{regenerated} images ({written} previews) in {elapsed:.2f}s on {args.jobs} processes: '
+          f'{regenerated / elapsed:.1f} images/s, {written / elapsed:.1f} previews/s')
+    return 0
+
+
+def run_apply(args):
+    """
+    Applies a theme without the GUI, for provisioning scripts. Never imports tkinter, and only imports PIL
+    when --optimise is given. Returns one of the EXIT_ codes.
+    """
+    themes_root, sample_root, cache_root = app_paths()
+    refind_root = args.refind_root or DEFAULT_REFIND_ROOT
+    theme_dir = os.path.join(themes_root, args.theme)
+    if args.theme.startswith('.') or args.theme == 'samples' or os.sep in args.theme or not os.path.isdir(theme_dir):
+        themes = sorted(d for d in os.listdir(themes_root) if not d.startswith('.') and d != 'samples'
+                        and os.path.isdir(os.path.join(themes_root, d))) if os.path.isdir(themes_root) else []
+        print(f"Unknown theme '{args.theme}', available themes: {', '.join(themes) or 'none'}", file=sys.stderr)
+        return EXIT_USAGE
+    config_file = next((os.path.join(theme_dir, c) for c in THEME_CONFIG_NAMES
+                        if os.path.isfile(os.path.join(theme_dir, c))), None)
+    if config_file is None:
+        print(f"Theme '{args.theme}' has no {' or '.join(THEME_CONFIG_NAMES)}", file=sys.stderr)
+        return EXIT_USAGE
+
+    bg_source = None
+    if args.bg:
+        bg_file = f'{args.bg}.png'
+        candidates = [os.path.join(theme_dir, 'bg', bg_file), os.path.join(sample_root, args.theme, bg_file)]
+        bg_source = next((c for c in candidates if os.path.isfile(c)), None)
+        if bg_source is None:
+            print(f"Theme '{args.theme}' has no background '{args.bg}'", file=sys.stderr)
+            return EXIT_USAGE
+    if not os.path.isdir(refind_root):
+        print(f"No rEFInd install found at '{refind_root}'", file=sys.stderr)
+        return EXIT_NO_REFIND
+
+    theme_root = os.path.join(refind_root, "theme")
+    hash_cache = FileHashCache(os.path.join(cache_root, "file_hashes.json"),
+                               ContentStore(os.path.join(themes_root, STORE_DIR_NAME)))
+    configs = ConfigStore()
+    try:
+        recover_theme_install(theme_root)
+        if args.bg:
+            set_theme_background(config_file, args.theme, args.bg, configs)
+        report = install_theme(theme_dir, refind_root, cache_root, hash_cache, args.optimise,
+                               bg_source=bg_source, configs=configs)
+        hash_cache.save()
+    except OSError as e:
+        print(f"Unable to apply '{args.theme}': {e}", file=sys.stderr)
+        return EXIT_FAILED
+
+    if report.errors:
+        for path, error in report.errors:
+            print(f'{path}: {error}', file=sys.stderr)
+        print(f"Failed to apply '{args.theme}', the previous theme was left in place", file=sys.stderr)
+        return EXIT_FAILED
+    print(f"Applied '{args.theme}'{f' with background {args.bg}' if args.bg else ''}")
+    return EXIT_OK
+
+
+def run_import(args):
+    """Imports theme archives, or every archive in a folder, in parallel without opening the GUI."""
+    themes_root, sample_root, cache_root = app_paths()
+    archives = []
+    for path in args.archives:
+        if os.path.isdir(path):
+            archives += sorted(os.path.join(path, name) for name in os.listdir(path)
+                               if name.lower().endswith(ARCHIVE_EXTENSIONS))
+        else:
+            archives.append(path)
+    if not archives:
+        print('No theme archives to import', file=sys.stderr)
+        return EXIT_USAGE
+    if args.name and len(archives) > 1:
+        print('--name can only be used when importing a single archive', file=sys.stderr)
+        return EXIT_USAGE
+
+    os.makedirs(themes_root, exist_ok=True)
+    catalogue = ThemeCatalogue(themes_root, sample_root, os.path.join(cache_root, "catalogue.json"))
+    catalogue.refresh()
+    store = PreviewStore(themes_root, sample_root, os.path.join(cache_root, "previews"))
+    start = time.perf_counter()
+    imported, errors = import_theme_archives(archives, themes_root, sample_root, store, catalogue, args.jobs, args.name)
+    elapsed = time.perf_counter() - start
+
+    for archive, name, files, size, seconds in imported:
+        print(f"Imported '{name}' from {os.path.basename(archive)}: {files} files, {size / 1e6:.1f} MB in {seconds:.2f}s")
+    for archive, error in errors:
+        print(f'Unable to import {archive}: {error}', file=sys.stderr)
+    print(f'{len(imported)} of {len(archives)} themes imported in {elapsed:.2f}s')
+    return EXIT_FAILED if errors else EXIT_OK
+
+
+def run_dedupe(args):
+    """Shares identical files between themes through the content store and reports the space saved."""
+    themes_root, sample_root, cache_root = app_paths()
+    store = ContentStore(os.path.join(themes_root, STORE_DIR_NAME))
+    hash_cache = FileHashCache(os.path.join(cache_root, "file_hashes.json"), store)
+    start = time.perf_counter()
+    report = store.dedupe(themes_root, hash_cache, args.dry_run)
+    hash_cache.save()
+    print(f'{"Would dedupe" if args.dry_run else "Deduped"} {themes_root} in {time.perf_counter() - start:.2f}s: '
+          f'{report}')
+    return EXIT_FAILED if report.errors else EXIT_OK
+
+
+def run_gui(args):
+    base_gui = tk.Tk()
+    app = ThemeSelectorApp(base_gui, hud=args.hud)
+    app.root.mainloop()
+    return 0
+
+
+def run_profiled(args, path):
+    """
+    Runs a command under cProfile and writes its stats to path (for pstats, snakeviz or flameprof) plus the
+    tracer's spans from every thread to path.trace.json (for chrome://tracing or Perfetto).
+    """
+    profiler = cProfile.Profile()
+    tracer.recording = True
+    profiler.enable()
+    try:
+        return args.func(args)
+    finally:
+        profiler.disable()
+        profiler.dump_stats(path)
+        tracer.write_events(path + '.trace.json')
+        pstats.Stats(profiler, stream=sys.stderr).sort_stats('cumulative').print_stats(25)
+        print(f'Profile written to {path}, trace events to {path}.trace.json', file=sys.stderr)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Browse, preview and install rEFInd themes. "
+                                                 "Opens the GUI when no command is given.")
+    parser.set_defaults(func=run_gui)
+    parser.add_argument("--trace", action="store_true", help="print progress messages and a timing summary per stage")
+    parser.add_argument("--hud", action="store_true", help="show the latency of the last keypress in the window")
+    parser.add_argument("--profile", metavar="FILE", help="profile the run, writing cProfile stats to FILE and "
+                                                          "trace events to FILE.trace.json")
+    commands = parser.add_subparsers(dest="command")
+
+    previews = commands.add_parser("previews", help="build preview images for every theme and background")
+    previews.add_argument("--jobs", type=int, default=os.cpu_count() or 1,
+                          help="worker processes to use (default: one per core)")
+    previews.add_argument("--force", action="store_true", help="rebuild previews that are already up to date")
+    previews.set_defaults(func=run_previews)
+
+    apply = commands.add_parser("apply", help="install a theme without opening the GUI")
+    apply.add_argument("theme", help="name of the theme folder in .themes")
+    apply.add_argument("--bg", metavar="NAME", help="background to use, without the .png extension")
+    apply.add_argument("--refind-root", metavar="PATH", help=f"rEFInd folder on the ESP (default: {DEFAULT_REFIND_ROOT})")
+    apply.add_argument("--optimise", action="store_true",
+                       help="resize and recompress images before installing (needs Pillow, slower the first time)")
+    apply.set_defaults(func=run_apply)
+
+    import_ = commands.add_parser("import", help="import theme archives (.zip, .tar.gz, ...) into .themes")
+    import_.add_argument("archives", nargs="+", metavar="ARCHIVE", help="theme archive, or a folder of them")
+    import_.add_argument("--name", help="theme name to use instead of the archive's, single archive only")
+    import_.add_argument("--jobs", type=int, default=os.cpu_count() or 1,
+                         help="archives to import at once (default: one per core)")
+    import_.set_defaults(func=run_import)
+
+    dedupe = commands.add_parser("dedupe", help="store identical theme files once and report the bytes saved")
+    dedupe.add_argument("--dry-run", action="store_true", help="only report what would be saved")
+    dedupe.set_defaults(func=run_dedupe)
+
+    args = parser.parse_args(argv)
+    tracer.enabled = args.trace or args.hud or bool(args.profile)
+    tracer.verbose = args.trace
+    try:
+        return run_profiled(args, args.profile) if args.profile else args.func(args)
+    finally:
+        if args.trace and tracer.totals:
+            print(tracer.summary())
+
+
+if __name__ == "__main__":
+    sys.exit(main())